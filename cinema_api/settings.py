@@ -35,6 +35,53 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Seconds a response is kept for replay to requests repeating the same Idempotency-Key header
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Admission control of reservation traffic per screening, see main/waiting_room.py. Needs a shared cache in CACHES
+WAITING_ROOM = {
+    'ENABLED': False,
+    'MAX_ACTIVE_SESSIONS': 200,
+    'ADMIT_RATE': 5,  # sessions admitted per second
+    'SESSION_TTL': 10 * 60,
+}
+
+# Screenings of the months before are moved to the archive tables by the archive_screenings command
+ARCHIVE_AFTER_MONTHS = 3
+
+# Seconds a daily programme document is kept in the cache, it is invalidated on schedule and reservation writes
+PROGRAMME_CACHE_TIMEOUT = 60 * 60
+
+# Days ahead the screenings of recurring schedules are created, and the longest period a schedule may cover
+SCHEDULE_WINDOW_DAYS = 14
+SCHEDULE_MAX_DAYS = 366
+
+# Asynchronous checkout processed by the process_checkouts command, see main/checkout.py
+CHECKOUT = {
+    'PAYMENT_PROVIDER': 'main.payments.StubPaymentProvider',
+    'WORKERS': 8,
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_DELAY_SECONDS': 2,
+    'CLAIM_TIMEOUT': 5 * 60,
+    'STUB_LATENCY_SECONDS': 0.2,
+    'STUB_FAILURE_RATE': 0,
+}
+
+# Statement timeouts in milliseconds of the views serving a stale copy instead, see main/degradation.py
+STATEMENT_TIMEOUTS = {
+    'available-seats': 500,
+    'best-seats': 500,
+    'programme': 2000,
+}
+
+# Seconds a compressed list response is cached, lists are also invalidated on changes, see main/compression.py
+PRECOMPRESSED_CACHE_TIMEOUT = 60 * 60
+
+# Rooms and movies kept in memory by each process, and seconds between checks for changes made by other processes
+REFERENCE_CACHE_SIZE = 1000
+REFERENCE_CACHE_CHECK_SECONDS = 5
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -48,7 +95,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
 
-    'main',
+    'main.apps.MainConfig',
 ]
 
 MIDDLEWARE = [
@@ -57,8 +104,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main.sharding.CinemaShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.profiling.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'cinema_api.urls'
@@ -96,6 +145,31 @@ DATABASES = {
 }
 
 
+# Shared by all processes: permissions, idempotency keys, waiting rooms, cached lists and the versions of the
+# reference cache. A process-local backend such as LocMemCache keeps their invalidations from reaching other
+# processes, see main/checks.py
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ.get('MEMCACHED_LOCATION', 'memcached:11211'),
+    }
+}
+
+
+AUTHENTICATION_BACKENDS = [
+    'main.backends.CachedModelBackend',
+]
+
+# Seconds the resolved permissions of a user are cached, changes of users, groups and permissions invalidate them
+PERMISSION_CACHE_TIMEOUT = 15 * 60
+
+# Databases holding the rooms, screenings and reservations of cinemas, each Cinema names its shard.
+# Every alias needs an entry in DATABASES with all migrations applied
+CINEMA_SHARDS = ['default']
+
+DATABASE_ROUTERS = ['main.sharding.CinemaShardRouter']
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,60 @@
+""" Moves screenings of closed months and their reservations to the archive tables.
+
+The live Screening and Reservation tables then only hold current data, so the schedule validation,
+availability and listing queries do not scan years of history. Native table partitioning is not used
+because Django 2.2 cannot manage partitioned tables or foreign keys into them. Screenings with checkouts still
+in progress are left for a later run. """
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from main import sharding
+from main.models import Screening, Reservation, ArchivedScreening, ArchivedReservation, Checkout
+
+SCREENING_FIELDS = ('id', 'room_id', 'movie_id', 'start_time', 'price')
+RESERVATION_FIELDS = ('id', 'screening_id', 'user_id', 'seat_id', 'reservation_time', 'purchase_time', 'price_paid')
+# copied, the archive references rooms, movies and seats without constraints and outlives them
+SCREENING_NAMES = {'room_name': F('room__name'), 'movie_title': F('movie__title')}
+RESERVATION_NAMES = {'seat_row': F('seat__row'), 'seat_number': F('seat__number')}
+INSERT_BATCH_SIZE = 1000
+
+
+def default_cutoff(now=None):
+    """ First day of the oldest month that is kept in the live tables """
+    now = timezone.localtime(now)
+    months = now.year * 12 + now.month - 1 - settings.ARCHIVE_AFTER_MONTHS
+    return timezone.make_aware(datetime(months // 12, months % 12 + 1, 1))
+
+
+def archive(before, batch_size=100):
+    """ Archives the screenings of the active shard starting before the cutoff, batch_size screenings per
+    transaction.
+    Returns the number of archived screenings and reservations """
+    screenings_count = reservations_count = 0
+    while True:
+        with sharding.atomic():
+            ids = list(Screening.objects.filter(start_time__lt=before).exclude(pk__in=_in_checkout())
+                       .order_by('pk').select_for_update().values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return screenings_count, reservations_count
+            ArchivedScreening.objects.bulk_create(
+                (ArchivedScreening(**values) for values in
+                 Screening.objects.filter(pk__in=ids).values(*SCREENING_FIELDS, **SCREENING_NAMES)),
+                batch_size=INSERT_BATCH_SIZE)
+            reservations = Reservation.objects.filter(screening_id__in=ids)
+            ArchivedReservation.objects.bulk_create(
+                (ArchivedReservation(**values) for values in
+                 reservations.values(*RESERVATION_FIELDS, **RESERVATION_NAMES).iterator(chunk_size=INSERT_BATCH_SIZE)),
+                batch_size=INSERT_BATCH_SIZE)
+            reservations_count += reservations.delete()[0]
+            Screening.objects.filter(pk__in=ids).delete()
+            screenings_count += len(ids)
+
+
+def _in_checkout():
+    """ Screenings with reservations whose checkout is not finished, they are archived once it is """
+    return Reservation.objects.filter(
+        pk__in=Checkout.objects.filter(status__in=(Checkout.PENDING, Checkout.PROCESSING)).values('reservation_id')
+    ).values('screening_id')
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+VERSION_KEY = 'permissions:version'
+
+
+class CachedModelBackend(ModelBackend):
+    """ ModelBackend keeping the resolved permissions of each user in the cache across requests.
+
+    Changes of users, groups and permissions invalidate the cached sets, see main/signals.py """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            key = _key(user_obj.pk)
+            permissions = cache.get(key)
+            if permissions is None:
+                permissions = super().get_all_permissions(user_obj)
+                cache.set(key, permissions, timeout=settings.PERMISSION_CACHE_TIMEOUT)
+            user_obj._perm_cache = permissions
+        return user_obj._perm_cache
+
+
+def invalidate_user(user_pk):
+    cache.delete(_key(user_pk))
+
+
+def invalidate_all():
+    """ Invalidates the permissions of every user by moving all keys to a new version """
+    cache.add(VERSION_KEY, 0, timeout=None)
+    cache.incr(VERSION_KEY)
+
+
+def _key(user_pk):
+    return 'permissions:{}:{}'.format(cache.get(VERSION_KEY, 0), user_pk)
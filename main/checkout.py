@@ -0,0 +1,152 @@
+""" Asynchronous checkout: purchases of reservations accepted by the API and processed by workers.
+
+A request only creates a pending Checkout row, so the payment and the ticket never hold a request worker.
+The process_checkouts command claims due checkouts in batches of BATCH_SIZE, charges them and renders their
+tickets on a pool of WORKERS threads, then completes the purchases in one transaction per batch; payments of
+reservations purchased meanwhile are refunded after it commits.
+Unavailable payments are retried after RETRY_DELAY_SECONDS, doubled on every attempt, up to MAX_ATTEMPTS.
+Checkouts of a crashed worker are claimed again after CLAIM_TIMEOUT seconds, checkouts of deleted reservations
+fail when they are claimed. """
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from main import sharding, stats, outbox
+from main.models import Checkout, Reservation, ChangeLogEntry
+from main.payments import get_provider, PaymentError
+
+TICKET_SALT = 'main.tickets'
+METRICS_WINDOW_SECONDS = 60
+
+
+class CheckoutError(Exception):
+    pass
+
+
+@sharding.atomic
+def start(reservation):
+    reservation = Reservation.objects.select_for_update().select_related('screening').get(pk=reservation.pk)
+    if reservation.is_purchased:
+        raise CheckoutError('The reservation is already purchased.')
+    if Checkout.objects.filter(reservation=reservation, status__in=(Checkout.PENDING, Checkout.PROCESSING)).exists():
+        raise CheckoutError('The reservation is already being checked out.')
+    return Checkout.objects.create(reservation=reservation, amount=reservation.screening.price)
+
+
+def process_batch(executor, provider=None, batch_size=None):
+    """ Processes one batch of due checkouts of the active shard, returns the number of claimed checkouts """
+    provider = provider or get_provider()
+    claimed_count, checkouts = _claim(batch_size or settings.CHECKOUT['BATCH_SIZE'])
+    results = list(executor.map(lambda checkout: _pay(provider, checkout), checkouts))
+    refunds = []
+    with sharding.atomic():
+        for checkout, (payment_id, ticket, error) in zip(checkouts, results):
+            with sharding.atomic():
+                if error is None:
+                    if not _complete(checkout, payment_id, ticket):
+                        refunds.append(checkout)
+                else:
+                    _fail(checkout, error)
+    # calls to the provider do not hold the locks and the change log entries of the batch
+    for checkout in refunds:
+        try:
+            provider.refund(checkout.payment_id)
+        except PaymentError as e:
+            Checkout.objects.filter(pk=checkout.pk).update(
+                error='The refund of {} failed: {}'.format(checkout.payment_id, e)[:200])
+    return claimed_count
+
+
+def render_ticket(reservation):
+    """ Signed content of the QR code of the ticket, checked at the entrance with read_ticket """
+    return signing.dumps({'reservation': reservation.pk, 'screening': reservation.screening_id,
+                          'row': reservation.seat.row, 'seat': reservation.seat.number,
+                          'start_time': reservation.screening.start_time.isoformat()}, salt=TICKET_SALT)
+
+
+def read_ticket(ticket):
+    return signing.loads(ticket, salt=TICKET_SALT)
+
+
+def metrics(now=None):
+    """ Queue sizes by status and the throughput and latency of the last METRICS_WINDOW_SECONDS """
+    now = now or timezone.now()
+    counts = dict(Checkout.objects.order_by().values_list('status').annotate(Count('id')))
+    recent = list(Checkout.objects.filter(status=Checkout.COMPLETED,
+                                          completed_at__gte=now - timedelta(seconds=METRICS_WINDOW_SECONDS))
+                  .values_list('created_at', 'completed_at'))
+    latencies = [(completed_at - created_at).total_seconds() for created_at, completed_at in recent]
+    return {
+        'pending': counts.get(Checkout.PENDING, 0),
+        'processing': counts.get(Checkout.PROCESSING, 0),
+        'completed': counts.get(Checkout.COMPLETED, 0),
+        'failed': counts.get(Checkout.FAILED, 0),
+        'completed_per_second': len(recent) / METRICS_WINDOW_SECONDS,
+        'average_seconds_to_complete': sum(latencies) / len(latencies) if latencies else None,
+    }
+
+
+def _claim(batch_size):
+    """ Claims due checkouts, returns the number of claimed checkouts and those that can be paid """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.CHECKOUT['CLAIM_TIMEOUT'])
+    with sharding.atomic():
+        # concurrent workers skip the rows locked by each other instead of waiting for them
+        pks = list(Checkout.objects.select_for_update(skip_locked=True)
+                   .filter(Q(status=Checkout.PENDING, next_attempt_at__lte=now) |
+                           Q(status=Checkout.PROCESSING, claimed_at__lt=stale))
+                   .order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size])
+        claimed = Checkout.objects.filter(pk__in=pks)
+        # the reservation relation has no constraint, the reservation may have been deleted meanwhile
+        claimed.exclude(reservation_id__in=Reservation.objects.values('pk')).update(
+            status=Checkout.FAILED, attempts=F('attempts') + 1, error='The reservation no longer exists.')
+        claimed.exclude(status=Checkout.FAILED).update(status=Checkout.PROCESSING, claimed_at=now)
+    # everything the workers need is read here, the threads do not query the database
+    return len(pks), list(claimed.filter(status=Checkout.PROCESSING)
+                          .select_related('reservation__screening', 'reservation__seat').order_by('next_attempt_at'))
+
+
+def _pay(provider, checkout):
+    try:
+        payment_id = provider.charge('checkout-{}'.format(checkout.pk), checkout.amount)
+    except PaymentError as e:
+        return None, None, e
+    return payment_id, render_ticket(checkout.reservation), None
+
+
+def _complete(checkout, payment_id, ticket):
+    """ Purchases the reservation, returns False when the payment has to be refunded """
+    checkout.attempts += 1
+    reservation = Reservation.objects.select_for_update().get(pk=checkout.reservation_id)
+    now = timezone.now()
+    if reservation.is_purchased:
+        # purchased by another checkout or synchronously meanwhile
+        _finish(checkout, Checkout.FAILED, payment_id=payment_id, error='The reservation is already purchased.')
+        return False
+    reservation.purchase_time = now
+    reservation.price_paid = checkout.amount
+    reservation.save(update_fields=['purchase_time', 'price_paid'])
+    stats.reservation_purchased(reservation)
+    outbox.record(reservation, ChangeLogEntry.PURCHASED)
+    _finish(checkout, Checkout.COMPLETED, payment_id=payment_id, ticket=ticket, completed_at=now, error='')
+    return True
+
+
+def _fail(checkout, error):
+    checkout.attempts += 1
+    if error.retryable and checkout.attempts < settings.CHECKOUT['MAX_ATTEMPTS']:
+        delay = settings.CHECKOUT['RETRY_DELAY_SECONDS'] * 2 ** (checkout.attempts - 1)
+        _finish(checkout, Checkout.PENDING, next_attempt_at=timezone.now() + timedelta(seconds=delay),
+                error=str(error))
+    else:
+        _finish(checkout, Checkout.FAILED, error=str(error))
+
+
+def _finish(checkout, status, **fields):
+    checkout.status = status
+    for name, value in fields.items():
+        setattr(checkout, name, value)
+    checkout.save()
@@ -0,0 +1,34 @@
+""" System checks of the deployment settings the app relies on.
+
+Invalidations of the reference cache and of the precompressed lists are published through the default cache,
+and the waiting room keeps its queues there, so it has to be shared by all processes of the deployment. """
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_cache_process_local():
+    return settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    if not is_cache_process_local():
+        return []
+    return [Warning('The default cache is local to each process.',
+                    hint='Changes made by one process, e.g. a management command, do not invalidate the reference '
+                         'cache and cached lists of the others. Configure a shared backend such as memcached.',
+                    id='main.W001')]
+
+
+@register()
+def check_waiting_room_cache(app_configs, **kwargs):
+    if not settings.WAITING_ROOM['ENABLED'] or not is_cache_process_local():
+        return []
+    # every process would admit MAX_ACTIVE_SESSIONS visitors from a queue of its own
+    return [Error('The waiting room is enabled but the default cache is local to each process.',
+                  hint='Configure a shared cache backend such as memcached.', id='main.E001')]
@@ -0,0 +1,116 @@
+""" List responses cached already compressed.
+
+The JSON body of a list is rendered once per content change and stored in the Django cache together with its
+gzip encoding and, when the brotli package is installed, its brotli encoding. Each request gets the best
+encoding its Accept-Encoding allows, so compression is paid once per change instead of on every request.
+Entries are keyed by a generation of every model the list shows, bumped whenever the model changes; the
+generations live in the shared cache, so changes made by management commands reach the web processes too.
+Lists rendered inside a transaction are neither served from nor stored in the cache. """
+import functools
+import gzip
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+from main import sharding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GENERATION_TIMEOUT = None
+# preferred first
+ENCODINGS = ('br', 'gzip')
+
+
+def invalidate(model, using=None):
+    """ Drops the cached lists showing the model, now and once the transaction of the change commits """
+    _bump(model)
+    transaction.on_commit(lambda: _bump(model), using=using or sharding.current_db())
+
+
+def encode(body):
+    """ The body in every available encoding, encodings not smaller than the body are left out """
+    encoded = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(body, quality=11)
+    return {coding: data for coding, data in encoded.items() if coding == 'identity' or len(data) < len(body)}
+
+
+def choose_encoding(accept_encoding, available):
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0
+        accepted[coding.strip().lower()] = quality
+    for coding in ENCODINGS:
+        if coding in available and accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return 'identity'
+
+
+def precompressed(*models):
+    """ Decorates the list method of a view to serve its JSON body from the compressed cache.
+    models are the models whose changes change the list """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            # a list rendered inside a transaction may show uncommitted rows
+            if request.accepted_renderer.format != 'json' or \
+                    transaction.get_connection(sharding.current_db()).in_atomic_block:
+                return method(view, request, *args, **kwargs)
+            key = _cache_key(request, models)
+            entry = cache.get(key)
+            if entry is None:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                body = request.accepted_renderer.render(response.data, request.accepted_media_type,
+                                                        view.get_renderer_context())
+                entry = {'content_type': '{}; charset=utf-8'.format(request.accepted_media_type.split(';')[0]),
+                         'encoded': encode(body)}
+                cache.set(key, entry, timeout=settings.PRECOMPRESSED_CACHE_TIMEOUT)
+            coding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), entry['encoded'])
+            response = HttpResponse(entry['encoded'][coding], content_type=entry['content_type'])
+            if coding != 'identity':
+                response['Content-Encoding'] = coding
+            # finalize_response sets the headers of the view over the ones of the response
+            view.headers['Vary'] = ', '.join(filter(None, (view.headers.get('Vary'), 'Accept-Encoding')))
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _cache_key(request, models):
+    generations = cache.get_many([_generation_key(model) for model in models])
+    # bodies hold absolute links built from the scheme and host of the request
+    digest = hashlib.sha1('{}:{}:{}:{}'.format(
+        request.accepted_media_type, request.build_absolute_uri('/'), request.get_full_path(),
+        [generations.get(_generation_key(model), 0) for model in models]).encode()).hexdigest()
+    return 'precompressed:{}:{}'.format(sharding.current_db(), digest)
+
+
+def _bump(model):
+    key = _generation_key(model)
+    cache.add(key, 0, timeout=GENERATION_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted right after the add
+        cache.set(key, 1, timeout=GENERATION_TIMEOUT)
+
+
+def _generation_key(model):
+    return 'precompressed-generation:{}'.format(model._meta.label)
@@ -0,0 +1,65 @@
+""" Optimistic concurrency control of updates with a version column exposed as ETag.
+
+Clients send the ETag they read in the If-Match header of an update. The version is compared and
+incremented with a single conditional UPDATE, so a concurrent update of the same version fails with
+412 instead of silently overwriting, without locking the row while the client edits. """
+from django.db import router, transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The resource has been modified since it was read, fetch it again and retry.'
+    default_code = 'precondition_failed'
+
+
+def etag(instance):
+    return '"{}"'.format(instance.version)
+
+
+class OptimisticConcurrencyMixin:
+    """ Adds ETag headers to the responses of a model viewset and checks If-Match on updates """
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        response['ETag'] = etag(instance)
+        return response
+
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = self.updated_etag
+        return response
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        model = type(instance)
+        expected_version = self._if_match_version(instance)
+        with transaction.atomic(using=router.db_for_write(model, instance=instance)):
+            rows = model.objects.filter(pk=instance.pk)
+            if expected_version is not None:
+                rows = rows.filter(version=expected_version)
+            if not rows.update(version=F('version') + 1):
+                raise PreconditionFailed()
+            if expected_version is None:
+                instance.version = rows.values_list('version', flat=True).get()
+            else:
+                instance.version = expected_version + 1
+            super().perform_update(serializer)
+        self.updated_etag = etag(instance)
+
+    def _if_match_version(self, instance):
+        if_match = self.request.META.get('HTTP_IF_MATCH')
+        if if_match is None or if_match.strip() == '*':
+            return None
+        for tag in if_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == etag(instance):
+                return instance.version
+        raise PreconditionFailed()
@@ -0,0 +1,67 @@
+""" Time budgets of the views that read the most under load.
+
+A budgeted block runs in a transaction whose statements PostgreSQL cancels after the STATEMENT_TIMEOUTS
+milliseconds of the view. When the database fails the block, the view serves the last good copy of its data
+marked with the X-Stale-Age header (seconds since it was computed) instead of an error, and the fallback is
+counted. Other databases have no per-transaction statement timeout, blocks run there without a budget. """
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+
+from main import sharding
+
+STALE_AGE_HEADER = 'X-Stale-Age'
+LAST_GOOD_TIMEOUT = 24 * 60 * 60
+FALLBACKS = ('available-seats', 'best-seats', 'programme')
+
+
+@contextmanager
+def time_budget(name):
+    alias = sharding.current_db()
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    with transaction.atomic(using=alias):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL statement_timeout = %s', [settings.STATEMENT_TIMEOUTS[name]])
+        yield
+
+
+def remember(key, value):
+    """ Keeps value as the last good copy of the data under key """
+    cache.set(_last_good_key(key), {'value': value, 'time': time.time()}, timeout=LAST_GOOD_TIMEOUT)
+
+
+def recall(key):
+    """ The last good copy under key and its age in seconds, or None """
+    entry = cache.get(_last_good_key(key))
+    if entry is None:
+        return None
+    return entry['value'], max(0, int(time.time() - entry['time']))
+
+
+def mark_stale(response, age):
+    response[STALE_AGE_HEADER] = str(age)
+    return response
+
+
+def count_fallback(name):
+    key = 'fallbacks:{}'.format(name)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def fallback_counts():
+    counts = cache.get_many(['fallbacks:{}'.format(name) for name in FALLBACKS])
+    return {name: counts.get('fallbacks:{}'.format(name), 0) for name in FALLBACKS}
+
+
+def _last_good_key(key):
+    return 'last-good:{}:{}'.format(sharding.current_db(), key)
@@ -0,0 +1,76 @@
+""" Streaming exports of reservations and screenings as CSV or JSON Lines.
+
+Rows are read with ``QuerySet.iterator`` (a server-side cursor on PostgreSQL) and encoded one at a time,
+so memory use does not depend on the number of exported rows. Rows of archived months are read from the
+archive tables, followed by the rows of the live tables. """
+import csv
+import itertools
+import json
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from main import sharding
+from main.models import Reservation, Screening, ArchivedReservation, ArchivedScreening
+
+CHUNK_SIZE = 2000
+
+EXPORTS = {
+    'reservations': (
+        ((ArchivedReservation.objects.order_by('pk'), (
+            'id', 'screening_id', 'screening__start_time', 'screening__movie_title', 'screening__room_name',
+            'seat_row', 'seat_number', 'user_id', 'reservation_time', 'purchase_time', 'price_paid')),
+         (Reservation.objects.order_by('pk'), (
+             'id', 'screening_id', 'screening__start_time', 'screening__movie__title', 'screening__room__name',
+             'seat__row', 'seat__number', 'user_id', 'reservation_time', 'purchase_time', 'price_paid'))),
+        'reservation_time',
+    ),
+    'screenings': (
+        ((ArchivedScreening.objects.order_by('pk'), ('id', 'room_name', 'movie_title', 'start_time', 'price')),
+         (Screening.objects.order_by('pk'), ('id', 'room__name', 'movie__title', 'start_time', 'price'))),
+        'start_time',
+    ),
+}
+
+
+def export_rows(name, month=None):
+    """ Returns the column names and an iterator over the rows of the export, optionally limited to
+    the month given as YYYY-MM. Archived rows read the copies of the names of their movie, room and seat,
+    which may have been deleted since, and are exported under the column names of the live rows """
+    sources, time_field = EXPORTS[name]
+    # bound now, the rows may be streamed after the shard of the request is deactivated
+    sources = [(queryset.using(sharding.current_db()), columns) for queryset, columns in sources]
+    if month:
+        start = timezone.make_aware(datetime.strptime(month, '%Y-%m'))
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        sources = [(queryset.filter(**{time_field + '__gte': start, time_field + '__lt': end}), columns)
+                   for queryset, columns in sources]
+    return sources[-1][1], itertools.chain.from_iterable(
+        queryset.values_list(*columns).iterator(chunk_size=CHUNK_SIZE) for queryset, columns in sources)
+
+
+def to_csv(columns, rows):
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def to_jsonl(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+FORMATS = {
+    'csv': to_csv,
+    'jsonl': to_jsonl,
+}
+
+
+class _LineBuffer:
+    """ Lets csv.writer return the written line instead of buffering it """
+
+    def write(self, value):
+        return value
@@ -0,0 +1,72 @@
+""" Sparse fieldsets: on reads, ``?fields=id,start_time`` serializes only the listed fields and
+``?omit=available_seats`` all but the listed ones. Unknown names are ignored.
+
+List views also load only the columns of the remaining fields, and join only the relations they traverse. """
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.permissions import SAFE_METHODS
+
+
+def _names(request, param):
+    return {name.strip() for name in request.query_params.get(param, '').split(',') if name.strip()}
+
+
+def is_sparse(request):
+    return request is not None and request.method in SAFE_METHODS and bool(
+        _names(request, 'fields') or _names(request, 'omit'))
+
+
+class SparseFieldsSerializerMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if not is_sparse(request):
+            return
+        fields, omit = _names(request, 'fields'), _names(request, 'omit')
+        for name in list(self.fields):
+            if fields and name not in fields or name in omit:
+                self.fields.pop(name)
+
+
+class SparseFieldsViewMixin:
+    # fields the view reads besides the serialized ones, e.g. to merge the lists of shards
+    loaded_fields = ()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list' or not is_sparse(self.request):
+            return queryset
+        columns, relations = set(self.loaded_fields), set()
+        for field in self.get_serializer().fields.values():
+            if field.source == '*':
+                # identity fields like hyperlinks need only the primary key and the paths they declare
+                for path in getattr(field, 'loaded_fields', ()):
+                    path = path.split('__')
+                    columns.add('__'.join(path))
+                    relations.update('__'.join(path[:i]) for i in range(1, len(path)))
+                continue
+            path = _lookup_path(queryset.model, field.source_attrs)
+            if path is None:
+                # computed from attributes that are not columns, nothing can be pruned safely
+                return queryset
+            columns.add('__'.join(path))
+            relations.update('__'.join(path[:i]) for i in range(1, len(path)))
+        queryset = queryset.select_related(None)
+        if relations:
+            # without arguments select_related would follow every foreign key
+            queryset = queryset.select_related(*relations)
+        return queryset.only('pk', *columns)
+
+
+def _lookup_path(model, attrs):
+    path = []
+    for index, attr in enumerate(attrs):
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None
+        if field.many_to_many or field.one_to_many:
+            return None
+        path.append(field.name)
+        if field.is_relation and index < len(attrs) - 1:
+            model = field.related_model
+    return path
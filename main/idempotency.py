@@ -0,0 +1,77 @@
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# marker lifetime of a request that is still being processed, a crashed worker must not block the key forever
+IN_PROGRESS_TIMEOUT = 60
+
+
+def idempotent(method):
+    """ Decorates a view method so that requests repeated with the same Idempotency-Key header
+    get the stored response back instead of executing the method again.
+
+    Only the status code and the response data are stored, keyed by user, path and key, and evicted
+    after IDEMPOTENCY_KEY_TTL seconds. Server errors are not stored so the client can retry them. """
+
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return method(view, request, *args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': 'Idempotency-Key must not be longer than {} characters.'.format(
+                                IDEMPOTENCY_KEY_MAX_LENGTH)})
+
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        if not cache.add(cache_key, {'fingerprint': fingerprint, 'status': None}, timeout=IN_PROGRESS_TIMEOUT):
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+            cache.set(cache_key, {'fingerprint': fingerprint, 'status': None}, timeout=IN_PROGRESS_TIMEOUT)
+
+        try:
+            response = method(view, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500:
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, {'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data},
+                      timeout=settings.IDEMPOTENCY_KEY_TTL)
+        return response
+
+    return wrapper
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response(status=422,
+                        data={'detail': 'Idempotency-Key has already been used with a different request.'})
+    if stored['status'] is None:
+        return Response(status=status.HTTP_409_CONFLICT,
+                        data={'detail': 'A request with this Idempotency-Key is still being processed.'})
+    response = Response(status=stored['status'], data=stored['data'])
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _cache_key(request, key):
+    digest = hashlib.sha1('{}:{}:{}'.format(request.user.pk, request.get_full_path(), key).encode()).hexdigest()
+    return 'idempotency:{}'.format(digest)
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha1('{}:{}'.format(request.method, body).encode()).hexdigest()
@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main import archive, sharding
+
+
+class Command(BaseCommand):
+    help = 'Moves screenings of closed months and their reservations to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='archive screenings starting before this month, as YYYY-MM. '
+                                             'Defaults to ARCHIVE_AFTER_MONTHS months ago')
+        parser.add_argument('--batch-size', type=int, default=100, help='screenings archived per transaction')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                before = timezone.make_aware(datetime.strptime(options['before'], '%Y-%m'))
+            except ValueError:
+                raise CommandError('Expected --before as YYYY-MM.')
+        else:
+            before = archive.default_cutoff()
+        for alias in settings.CINEMA_SHARDS:
+            with sharding.shard(alias):
+                screenings_count, reservations_count = archive.archive(before, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('Archived {} screenings and {} reservations of {} started before {}'
+                                                 .format(screenings_count, reservations_count, alias, before.date())))
@@ -0,0 +1,28 @@
+import itertools
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main import export, sharding
+
+
+class Command(BaseCommand):
+    help = 'Streams reservations or screenings of all shards as CSV or JSON Lines to stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(export.EXPORTS))
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='csv')
+        parser.add_argument('--month', help='only rows of the month, as YYYY-MM')
+
+    def handle(self, *args, **options):
+        shard_rows = []
+        for alias in settings.CINEMA_SHARDS:
+            with sharding.shard(alias):
+                try:
+                    columns, rows = export.export_rows(options['name'], month=options['month'])
+                except ValueError:
+                    raise CommandError('Expected --month as YYYY-MM.')
+                shard_rows.append(rows)
+        rows = itertools.chain.from_iterable(shard_rows)
+        for line in export.FORMATS[options['format']](columns, rows):
+            self.stdout.write(line, ending='')
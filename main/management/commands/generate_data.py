@@ -0,0 +1,48 @@
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main import sharding, synthetic
+
+
+class Command(BaseCommand):
+    help = 'Generates a deterministic synthetic cinema with its rooms, screenings and reservations for scale tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', default='default', help='shard of the generated cinema')
+        parser.add_argument('--first-day', help='day of the first screenings, as YYYY-MM-DD. Defaults to today')
+        parser.add_argument('--days', type=int, default=30, help='days of screenings')
+        parser.add_argument('--rooms', type=int, default=10, help='rooms of the cinema')
+        parser.add_argument('--movies', type=int, default=50)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--fill', type=float, default=.7,
+                            help='share of seats reserved for a prime time screening of an average movie')
+        parser.add_argument('--seed', type=int, default=0, help='the same seed and arguments give the same data')
+        parser.add_argument('--batch-size', type=int, default=synthetic.BATCH_SIZE, help='rows per insert')
+
+    def handle(self, *args, **options):
+        if options['shard'] not in settings.CINEMA_SHARDS:
+            raise CommandError('Unknown shard {}.'.format(options['shard']))
+        if options['first_day']:
+            try:
+                first_day = datetime.strptime(options['first_day'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Expected --first-day as YYYY-MM-DD.')
+        else:
+            first_day = timezone.localdate()
+        if min(options['days'], options['rooms'], options['movies'], options['users'], options['batch_size']) < 1:
+            raise CommandError('Expected at least one day, room, movie, user and row per insert.')
+        if not 0 <= options['fill'] <= 1:
+            raise CommandError('Expected --fill between 0 and 1.')
+
+        started = time.monotonic()
+        with sharding.shard(options['shard']):
+            counts = synthetic.generate(first_day, options['days'], options['rooms'], options['movies'],
+                                        options['users'], fill=options['fill'], seed=options['seed'],
+                                        batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Generated {} on {} in {:.1f}s'.format(
+            ', '.join('{} {}'.format(count, name) for name, count in counts.items()), options['shard'],
+            time.monotonic() - started)))
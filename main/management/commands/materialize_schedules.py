@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main import schedules, sharding
+
+
+class Command(BaseCommand):
+    help = 'Creates the screenings of the recurring schedules for the next SCHEDULE_WINDOW_DAYS days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--until', help='create screenings up to this day, as YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        if options['until']:
+            try:
+                until = datetime.strptime(options['until'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Expected --until as YYYY-MM-DD.')
+        else:
+            until = timezone.localdate() + timedelta(days=settings.SCHEDULE_WINDOW_DAYS)
+        for alias in settings.CINEMA_SHARDS:
+            with sharding.shard(alias):
+                created_count = schedules.materialize(until)
+            self.stdout.write(self.style.SUCCESS('Created {} screenings of {} up to {}'
+                                                 .format(created_count, alias, until)))
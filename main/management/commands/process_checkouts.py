@@ -0,0 +1,31 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import checkout, sharding
+from main.payments import get_provider
+
+
+class Command(BaseCommand):
+    help = 'Processes the pending checkouts of all shards, payments and tickets run on a pool of CHECKOUT WORKERS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='exit once no checkout is due')
+        parser.add_argument('--idle-seconds', type=float, default=1, help='wait between polls when no checkout is due')
+
+    def handle(self, *args, **options):
+        provider = get_provider()
+        with ThreadPoolExecutor(max_workers=settings.CHECKOUT['WORKERS']) as executor:
+            while True:
+                processed_count = 0
+                for alias in settings.CINEMA_SHARDS:
+                    with sharding.shard(alias):
+                        processed_count += checkout.process_batch(executor, provider)
+                if processed_count:
+                    self.stdout.write('Processed {} checkouts'.format(processed_count))
+                elif options['once']:
+                    return
+                else:
+                    time.sleep(options['idle_seconds'])
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import stats, sharding
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the occupancy and revenue aggregates of screenings, movies and days'
+
+    def handle(self, *args, **options):
+        for alias in settings.CINEMA_SHARDS:
+            with sharding.shard(alias):
+                stats.reconcile()
+            self.stdout.write(self.style.SUCCESS('Aggregates of {} reconciled'.format(alias)))
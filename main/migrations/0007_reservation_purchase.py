@@ -0,0 +1,27 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_reservation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reservation',
+            name='price_paid',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='purchase_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reservation',
+            unique_together={('screening', 'seat')},
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_reservation_purchase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('capacity', models.IntegerField(default=0)),
+                ('reserved_count', models.IntegerField(default=0)),
+                ('sold_count', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+                ('date', models.DateField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieStats',
+            fields=[
+                ('capacity', models.IntegerField(default=0)),
+                ('reserved_count', models.IntegerField(default=0)),
+                ('sold_count', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='main.Movie')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ScreeningStats',
+            fields=[
+                ('capacity', models.IntegerField(default=0)),
+                ('reserved_count', models.IntegerField(default=0)),
+                ('sold_count', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+                ('screening', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='main.Screening')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0008_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='screening',
+            name='start_time',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedScreening',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('start_time', models.DateTimeField(db_index=True)),
+                ('price', models.IntegerField()),
+                ('movie', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='main.Movie')),
+                ('room', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='main.TheaterRoom')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('reservation_time', models.DateTimeField()),
+                ('purchase_time', models.DateTimeField(blank=True, null=True)),
+                ('price_paid', models.IntegerField(blank=True, null=True)),
+                ('screening', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.ArchivedScreening')),
+                ('seat', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='main.Seat')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProgramme',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+                ('document', models.TextField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards_func(apps, schema_editor):
+    """ Assign the existing Theater Rooms to a cinema """
+    Cinema = apps.get_model("main", "Cinema")
+    TheaterRoom = apps.get_model("main", "TheaterRoom")
+    db_alias = schema_editor.connection.alias
+    rooms = TheaterRoom.objects.using(db_alias).filter(cinema__isnull=True)
+    if rooms.exists():
+        cinema = Cinema.objects.using(db_alias).create(name="Cinema", shard=db_alias)
+        rooms.update(cinema=cinema)
+
+
+def reverse_func(apps, schema_editor):
+    """ No need to do anything since the column and the table are dropped completely """
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_daily_programme'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cinema',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('shard', models.CharField(default='default', max_length=30)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='theaterroom',
+            name='cinema',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='main.Cinema'),
+        ),
+        migrations.RunPython(forwards_func, reverse_func),
+    ]
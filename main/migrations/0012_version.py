@@ -0,0 +1,23 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_cinema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='version',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='screening',
+            name='version',
+            field=models.IntegerField(default=1),
+        ),
+    ]
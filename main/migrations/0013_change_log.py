@@ -0,0 +1,24 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('entity', models.CharField(max_length=20)),
+                ('entity_id', models.IntegerField()),
+                ('action', models.CharField(max_length=10)),
+                ('payload', models.TextField()),
+            ],
+        ),
+    ]
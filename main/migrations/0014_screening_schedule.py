@@ -0,0 +1,32 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScreeningSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.IntegerField()),
+                ('first_day', models.DateField()),
+                ('last_day', models.DateField()),
+                ('times', models.CharField(max_length=200)),
+                ('materialized_until', models.DateField(blank=True, null=True)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.Movie')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.TheaterRoom')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='screening',
+            name='schedule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.ScreeningSchedule'),
+        ),
+    ]
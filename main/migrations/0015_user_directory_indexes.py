@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db import migrations
+
+# case insensitive prefix search compiles to UPPER("auth_user"."email"::text) LIKE UPPER('prefix%'),
+# which only expression indexes with the pattern operator class can serve
+INDEXES = (
+    ('main_user_username_prefix', 'UPPER("username"::text) text_pattern_ops'),
+    ('main_user_email_prefix', 'UPPER("email"::text) text_pattern_ops'),
+    ('main_user_date_joined', '"date_joined" DESC, "id" DESC'),
+)
+
+
+def forwards_func(apps, schema_editor):
+    """ Indexes of the admin user directory, the expression indexes are PostgreSQL specific """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, columns in INDEXES:
+        schema_editor.execute('CREATE INDEX "{}" ON "auth_user" ({})'.format(name, columns))
+
+
+def reverse_func(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, columns in INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS "{}"'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0014_screening_schedule'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_func, reverse_func),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_user_directory_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='theaterroom',
+            name='seat_categories',
+            field=models.BinaryField(default=b''),
+        ),
+    ]
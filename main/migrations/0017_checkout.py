@@ -0,0 +1,35 @@
+# Generated by Django 2.2.3 on 2026-10-19 07:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_seat_categories'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Checkout',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField()),
+                ('status', models.CharField(default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('payment_id', models.CharField(blank=True, max_length=64)),
+                ('ticket', models.TextField(blank=True)),
+                ('error', models.CharField(blank=True, max_length=200)),
+                ('reservation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Reservation')),
+            ],
+            options={
+                'index_together': {('status', 'next_attempt_at')},
+            },
+        ),
+    ]
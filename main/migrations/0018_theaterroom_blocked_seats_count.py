@@ -0,0 +1,29 @@
+# Generated by Django 2.2.3 on 2026-10-19 08:08
+
+from django.db import migrations, models
+
+BLOCKED = 4
+
+
+def count_blocked_seats(apps, schema_editor):
+    TheaterRoom = apps.get_model('main', 'TheaterRoom')
+    db_alias = schema_editor.connection.alias
+    for room in TheaterRoom.objects.using(db_alias).exclude(seat_categories=b''):
+        room.blocked_seats_count = sum(1 for bits in bytes(room.seat_categories) if bits & BLOCKED)
+        room.save(update_fields=['blocked_seats_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_checkout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='theaterroom',
+            name='blocked_seats_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_blocked_seats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.3 on 2026-10-19 08:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_theaterroom_blocked_seats_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='checkout',
+            name='reservation',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='main.Reservation'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.3 on 2026-10-19 08:21
+
+from django.db import migrations, models
+
+
+def position_existing_entries(apps, schema_editor):
+    # the cursors consumers hold are ids of the feed so far, new positions follow the last id
+    ChangeLogEntry = apps.get_model('main', 'ChangeLogEntry')
+    ChangeLogEntry.objects.using(schema_editor.connection.alias).update(position=models.F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_checkout_outlives_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelogentry',
+            name='position',
+            field=models.BigIntegerField(null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='changelogentry',
+            index=models.Index(condition=models.Q(position__isnull=True), fields=['id'], name='changelog_unpositioned'),
+        ),
+        migrations.RunPython(position_existing_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.2.3 on 2026-10-19 08:24
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def copy_names(apps, schema_editor):
+    # rows whose room, movie or seat was deleted already keep empty names
+    db_alias = schema_editor.connection.alias
+    TheaterRoom, Movie, Seat = (apps.get_model('main', name) for name in ('TheaterRoom', 'Movie', 'Seat'))
+    rooms = TheaterRoom.objects.using(db_alias).filter(pk=OuterRef('room_id'))
+    movies = Movie.objects.using(db_alias).filter(pk=OuterRef('movie_id'))
+    apps.get_model('main', 'ArchivedScreening').objects.using(db_alias).update(
+        room_name=Coalesce(Subquery(rooms.values('name')[:1]), Value('')),
+        movie_title=Coalesce(Subquery(movies.values('title')[:1]), Value('')))
+    seats = Seat.objects.using(db_alias).filter(pk=OuterRef('seat_id'))
+    apps.get_model('main', 'ArchivedReservation').objects.using(db_alias).update(
+        seat_row=Subquery(seats.values('row')[:1]), seat_number=Subquery(seats.values('number')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_change_feed_positions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedreservation',
+            name='seat_number',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedreservation',
+            name='seat_row',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedscreening',
+            name='movie_title',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='archivedscreening',
+            name='room_name',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.RunPython(copy_names, migrations.RunPython.noop),
+    ]
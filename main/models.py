@@ -1,15 +1,41 @@
-from datetime import timedelta
+from datetime import timedelta, datetime
 
 from django.conf import settings
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+
+class Cinema(models.Model):
+    """ Site operating theater rooms. Its rooms, screenings and reservations are stored on the database
+    named by shard, see main/sharding.py """
+    name = models.CharField(max_length=50)
+    shard = models.CharField(max_length=30, default='default')
+
+    def __str__(self):
+        return self.name
 
 
 class TheaterRoom(models.Model):
     """ Theater room has rectangular shape and is defined by rows and seats count """
 
+    cinema = models.ForeignKey('Cinema', on_delete=models.PROTECT, null=True)
     name = models.CharField(max_length=20)
     rows_count = models.IntegerField()
     seats_per_row_count = models.IntegerField()
+    # one byte per seat in row-major order with the Seat category bits, empty when no seat has a category
+    seat_categories = models.BinaryField(default=b'')
+    # seats with the BLOCKED bit, so capacities can be computed in queries
+    blocked_seats_count = models.IntegerField(default=0)
+
+    def get_seat_categories(self):
+        """ Category bits of every seat, row 1 seat 1 first """
+        return bytes(self.seat_categories or b'').ljust(self.rows_count * self.seats_per_row_count, b'\x00')
+
+    @property
+    def capacity(self):
+        """ Seats that can be reserved """
+        return self.rows_count * self.seats_per_row_count - self.blocked_seats_count
 
     def __str__(self):
         return self.name
@@ -19,6 +45,7 @@ class Movie(models.Model):
     TITLE_MAX_LENGTH = 100
     title = models.CharField(max_length=TITLE_MAX_LENGTH)
     duration_minutes = models.IntegerField()
+    version = models.IntegerField(default=1)
 
     def __str__(self):
         return self.title
@@ -27,8 +54,10 @@ class Movie(models.Model):
 class Screening(models.Model):
     room = models.ForeignKey('TheaterRoom', on_delete=models.PROTECT)
     movie = models.ForeignKey('Movie', on_delete=models.PROTECT)
-    start_time = models.DateTimeField()
+    start_time = models.DateTimeField(db_index=True)
     price = models.IntegerField()
+    version = models.IntegerField(default=1)
+    schedule = models.ForeignKey('ScreeningSchedule', on_delete=models.SET_NULL, null=True, blank=True)
 
     CLEANING_TIME_MIN = 15
     ADS_TIME_MIN = 10
@@ -38,11 +67,37 @@ class Screening(models.Model):
     def end_time(self):
         return self.start_time + timedelta(minutes=self.movie.duration_minutes + self.IDLE_TIME)
 
+    @property
+    def day(self):
+        return timezone.localtime(self.start_time).date()
+
     def __str__(self):
         return "{} from {} till {} in {}".format(self.movie.title, self.start_time, self.end_time, self.room.name)
 
 
+class ScreeningSchedule(models.Model):
+    """ Screenings of a movie in a room every day from first_day till last_day at the given times.
+    They are materialized into Screening rows a rolling window ahead, see main/schedules.py """
+    TIMES_MAX_LENGTH = 200
+
+    room = models.ForeignKey('TheaterRoom', on_delete=models.PROTECT)
+    movie = models.ForeignKey('Movie', on_delete=models.PROTECT)
+    price = models.IntegerField()
+    first_day = models.DateField()
+    last_day = models.DateField()
+    times = models.CharField(max_length=TIMES_MAX_LENGTH)  # comma separated HH:MM
+    materialized_until = models.DateField(null=True, blank=True)
+
+    def start_times(self):
+        return [datetime.strptime(t.strip(), '%H:%M').time() for t in self.times.split(',')]
+
+
 class Seat(models.Model):
+    VIP = 1
+    ACCESSIBLE = 2
+    BLOCKED = 4  # never available
+    CATEGORIES = {'vip': VIP, 'accessible': ACCESSIBLE, 'blocked': BLOCKED}
+
     room = models.ForeignKey('TheaterRoom', on_delete=models.CASCADE)
     row = models.IntegerField()
     number = models.IntegerField()
@@ -53,5 +108,113 @@ class Reservation(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     seat = models.ForeignKey('Seat', on_delete=models.PROTECT)
     reservation_time = models.DateTimeField()
-    purchase_time = models.DateTimeField()
-    price_paid = models.IntegerField()
+    purchase_time = models.DateTimeField(null=True, blank=True)
+    price_paid = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('screening', 'seat')
+
+    @property
+    def is_purchased(self):
+        return self.purchase_time is not None
+
+
+class ArchivedScreening(models.Model):
+    """ Screening of a closed period moved out of the Screening table, see main/archive.py.
+    Rooms and movies are referenced without constraints so archived history never blocks their deletion,
+    their names are copied for the exports """
+    id = models.IntegerField(primary_key=True)
+    room = models.ForeignKey('TheaterRoom', on_delete=models.DO_NOTHING, db_constraint=False)
+    movie = models.ForeignKey('Movie', on_delete=models.DO_NOTHING, db_constraint=False)
+    start_time = models.DateTimeField(db_index=True)
+    price = models.IntegerField()
+    room_name = models.CharField(max_length=20, blank=True)
+    movie_title = models.CharField(max_length=Movie.TITLE_MAX_LENGTH, blank=True)
+
+
+class ArchivedReservation(models.Model):
+    id = models.IntegerField(primary_key=True)
+    screening = models.ForeignKey('ArchivedScreening', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False)
+    seat = models.ForeignKey('Seat', on_delete=models.DO_NOTHING, db_constraint=False)
+    seat_row = models.IntegerField(null=True)
+    seat_number = models.IntegerField(null=True)
+    reservation_time = models.DateTimeField()
+    purchase_time = models.DateTimeField(null=True, blank=True)
+    price_paid = models.IntegerField(null=True, blank=True)
+
+
+class OccupancyStats(models.Model):
+    """ Aggregates of reservations kept up to date on reservation writes, see main/stats.py """
+    capacity = models.IntegerField(default=0)
+    reserved_count = models.IntegerField(default=0)
+    sold_count = models.IntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def occupancy(self):
+        return round(100 * self.reserved_count / self.capacity, 2) if self.capacity else 0
+
+
+class ScreeningStats(OccupancyStats):
+    screening = models.OneToOneField('Screening', on_delete=models.CASCADE, primary_key=True, related_name='stats')
+
+
+class MovieStats(OccupancyStats):
+    movie = models.OneToOneField('Movie', on_delete=models.CASCADE, primary_key=True, related_name='stats')
+
+
+class DailyStats(OccupancyStats):
+    date = models.DateField(primary_key=True)
+
+
+class DailyProgramme(models.Model):
+    """ Ready to serve JSON document of the screenings of a day, see main/programme.py """
+    date = models.DateField(primary_key=True)
+    document = models.TextField()
+
+
+class ChangeLogEntry(models.Model):
+    """ Append-only log of writes, recorded in the transaction of the write, see main/outbox.py """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    PURCHASED = 'purchased'
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    entity = models.CharField(max_length=20)
+    entity_id = models.IntegerField()
+    action = models.CharField(max_length=10)
+    payload = models.TextField()
+    # order of the change feed, assigned after the write commits
+    position = models.BigIntegerField(null=True, unique=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['id'], name='changelog_unpositioned', condition=Q(position__isnull=True))]
+
+
+class Checkout(models.Model):
+    """ Purchase of a reservation processed asynchronously by the checkout workers, see main/checkout.py """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    # payment records outlive their reservation, which archive_screenings moves to ArchivedReservation with its id
+    reservation = models.ForeignKey('Reservation', on_delete=models.DO_NOTHING, db_constraint=False)
+    amount = models.IntegerField()
+    status = models.CharField(max_length=10, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    payment_id = models.CharField(max_length=64, blank=True)
+    ticket = models.TextField(blank=True)
+    error = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        index_together = (('status', 'next_attempt_at'),)
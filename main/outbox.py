@@ -0,0 +1,59 @@
+""" Transactional outbox: writes of reservations, screenings and movies append an entry to the change log
+in their own transaction, so consumers tailing the feed see exactly the committed changes.
+
+Ids are assigned on insert but transactions commit out of id order, however long they run, so the feed does not
+page on ids. Entries get their feed position after they commit: readers number the committed entries without a
+position one assignment at a time, and the positions of an assignment commit before the next one starts, so no
+entry ever becomes visible behind a position a consumer has passed. """
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import Max
+from django.forms.models import model_to_dict
+
+from main import sharding
+from main.models import ChangeLogEntry
+
+# key of the PostgreSQL advisory lock serializing the position assignments
+POSITION_LOCK = 0x6f7574626f78
+ASSIGN_BATCH_SIZE = 1000
+
+
+def record(instance, action):
+    """ Appends the change of the instance to the change log of the database the instance is stored on """
+    ChangeLogEntry.objects.using(instance._state.db or sharding.current_db()).create(
+        entity=instance._meta.model_name, entity_id=instance.pk, action=action,
+        payload=json.dumps(model_to_dict(instance), cls=DjangoJSONEncoder))
+
+
+def record_many(instances, action):
+    """ Appends the changes of bulk written instances of one database with a single insert """
+    entries = [ChangeLogEntry(entity=instance._meta.model_name, entity_id=instance.pk, action=action,
+                              payload=json.dumps(model_to_dict(instance), cls=DjangoJSONEncoder))
+               for instance in instances]
+    if entries:
+        ChangeLogEntry.objects.using(instances[0]._state.db or sharding.current_db()).bulk_create(entries)
+
+
+def read(after, limit):
+    """ Entries after the feed position ``after``, in position order """
+    assign_positions()
+    return ChangeLogEntry.objects.filter(position__gt=after).order_by('position')[:limit]
+
+
+def assign_positions():
+    """ Numbers the committed entries without a feed position in id order, after the last position """
+    alias = sharding.current_db()
+    connection = connections[alias]
+    with transaction.atomic(using=alias):
+        if connection.vendor == 'postgresql':
+            # held until the positions commit, other databases serialize the writes themselves
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [POSITION_LOCK])
+        last = ChangeLogEntry.objects.aggregate(last=Max('position'))['last'] or 0
+        entries = list(ChangeLogEntry.objects.filter(position__isnull=True).order_by('pk').only('pk')
+                       [:ASSIGN_BATCH_SIZE])
+        for position, entry in enumerate(entries, last + 1):
+            entry.position = position
+        ChangeLogEntry.objects.bulk_update(entries, ['position'])
@@ -0,0 +1,78 @@
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class UserCursorPagination(CursorPagination):
+    """ Pages of the newest users first. Cursors hold the whole (date_joined, id) position and pages start right
+    after it, also among users joined at the same time such as bulk imported accounts. The position is bounded on
+    date_joined as well, so the index scan starts at the cursor and every page costs the same however deep it is.
+    DRF seeks on the first ordering field only and steps over ties with an offset capped at offset_cutoff """
+    ordering = ('-date_joined', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    POSITION_SEPARATOR = '|'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse, position = (self.cursor.reverse, self.cursor.position) if self.cursor else (False, None)
+
+        if reverse:
+            queryset = queryset.order_by(*(f[1:] if f.startswith('-') else '-' + f for f in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self._following(queryset.model, position, reverse))
+
+        # one more row tells whether a page follows
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+
+        # positions are unique, so the links of the parent class never need an offset
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous, self.previous_position = following_position is not None, following_position
+        else:
+            self.has_next, self.next_position = following_position is not None, following_position
+            self.has_previous, self.previous_position = position is not None, position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _get_position_from_instance(self, instance, ordering):
+        return self.POSITION_SEPARATOR.join(
+            str(instance[f.lstrip('-')] if isinstance(instance, dict) else getattr(instance, f.lstrip('-')))
+            for f in ordering)
+
+    def _following(self, model, position, reverse):
+        """ Rows after the position in the order of the query, e.g.
+        date_joined <= d and (date_joined < d or date_joined = d and id < i). The bound on the leading field is
+        redundant but lets the database start the index scan at the position, which it does not do for the OR """
+        values = position.split(self.POSITION_SEPARATOR)
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+            lookup = '__lt' if field.startswith('-') != reverse else '__gt'
+            condition |= Q(**equal, **{name + lookup: value})
+            equal[name] = value
+        leading = self.ordering[0].lstrip('-')
+        lookup = '__lte' if self.ordering[0].startswith('-') != reverse else '__gte'
+        return Q(**{leading + lookup: equal[leading]}) & condition
@@ -0,0 +1,52 @@
+""" Payment providers of the checkout pipeline.
+
+A provider charges an amount under a reference and returns the id of the payment. Charging the same reference
+again must return the first payment instead of charging twice, so a checkout retried after a worker crash
+is safe. Failures raise PaymentDeclined, which is final, or PaymentUnavailable, which is retried. """
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+PAYMENT_TIMEOUT = 24 * 60 * 60
+
+
+class PaymentError(Exception):
+    retryable = False
+
+
+class PaymentDeclined(PaymentError):
+    pass
+
+
+class PaymentUnavailable(PaymentError):
+    retryable = True
+
+
+def get_provider():
+    return import_string(settings.CHECKOUT['PAYMENT_PROVIDER'])()
+
+
+class StubPaymentProvider:
+    """ Local stand-in for a payment gateway. Every call takes STUB_LATENCY_SECONDS and fails with
+    a STUB_FAILURE_RATE probability; payments are kept in the Django cache """
+
+    def charge(self, reference, amount):
+        self._call()
+        key = 'payment:{}'.format(reference)
+        payment_id = uuid.uuid4().hex
+        if not cache.add(key, payment_id, timeout=PAYMENT_TIMEOUT):
+            return cache.get(key)
+        return payment_id
+
+    def refund(self, payment_id):
+        self._call()
+
+    @staticmethod
+    def _call():
+        time.sleep(settings.CHECKOUT['STUB_LATENCY_SECONDS'])
+        if random.random() < settings.CHECKOUT['STUB_FAILURE_RATE']:
+            raise PaymentUnavailable('The payment provider is unavailable.')
@@ -1,5 +1,8 @@
+from django.conf import settings
 from rest_framework import permissions
 
+from main import waiting_room
+
 
 class RetrieveUpdateSelfOnlyOrAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -15,3 +18,22 @@ class CreateAnonymousOrAdmin(permissions.BasePermission):
 class ListAdminOnly(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user and request.user.is_staff or view.action != 'list'
+
+
+class ChangeModelPermissions(permissions.DjangoModelPermissions):
+    """ POST actions that modify existing objects need the change permission instead of the add one """
+    perms_map = dict(permissions.DjangoModelPermissions.perms_map, POST=['%(app_label)s.change_%(model_name)s'])
+
+
+class AdmittedFromWaitingRoom(permissions.BasePermission):
+    """ While the waiting room is enabled, screening requests of the view need a token admitted by it """
+    message = 'Join the waiting room of the screening and retry with its token once admitted.'
+
+    def has_permission(self, request, view):
+        if not settings.WAITING_ROOM['ENABLED']:
+            return True
+        screening_pk = view.get_waiting_room_screening()
+        if screening_pk is None:
+            return True
+        token = request.META.get('HTTP_X_WAITING_ROOM_TOKEN', '')
+        return waiting_room.is_admitted(token, screening_pk, request.user)
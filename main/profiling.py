@@ -0,0 +1,100 @@
+""" Opt-in profiling of single requests for admin users.
+
+A request with the ``X-Profile`` header or the ``profile`` query parameter from a staff user is run under
+cProfile with all SQL statements recorded. The report is stored in the cache for PROFILE_TTL seconds and
+its id returned in the ``X-Profile-Id`` header, to be read at ``/api/profiles/<id>``.
+Requests without the flag only pay for the lookup of the flag. """
+import cProfile
+import io
+import pstats
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAMETER = 'profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+PROFILE_TTL = 60 * 60
+TOP_FUNCTIONS = 50
+
+
+class ProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if PROFILE_HEADER not in request.META and PROFILE_PARAMETER not in request.GET:
+            return self.get_response(request)
+        if not _is_staff(request):
+            return self.get_response(request)
+
+        queries = []
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(connections[alias].execute_wrapper(_QueryRecorder(alias, queries)))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+
+        profile_id = uuid.uuid4().hex
+        cache.set(_key(profile_id), {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'queries': queries,
+            'functions': _format_stats(profiler),
+        }, timeout=PROFILE_TTL)
+        response[PROFILE_ID_HEADER] = profile_id
+        return response
+
+
+def get_report(profile_id):
+    return cache.get(_key(profile_id))
+
+
+class _QueryRecorder:
+    def __init__(self, alias, queries):
+        self.alias = alias
+        self.queries = queries
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'database': self.alias, 'sql': sql,
+                                 'duration_ms': round((time.perf_counter() - started) * 1000, 3)})
+
+
+def _is_staff(request):
+    # the middleware runs before the JWT authentication of the views
+    user = request.user
+    if not user.is_authenticated:
+        try:
+            authenticated = JWTAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            authenticated = None
+        user = authenticated[0] if authenticated else user
+    return user.is_staff
+
+
+def _format_stats(profiler):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    return output.getvalue()
+
+
+def _key(profile_id):
+    return 'profile:{}'.format(profile_id)
@@ -0,0 +1,74 @@
+""" Daily programme snapshots: all screenings of a day with their movie, room and seats left.
+
+The document of a day is built once, stored as JSON in DailyProgramme and in the cache, and served as is.
+Writes invalidate only the days they affect; schedule changes rebuild them right after commit and
+reservations leave the rebuild to the next read, so a burst of reservations costs a single rebuild. """
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F
+
+from main import sharding, degradation
+from main.models import Screening, DailyProgramme
+
+
+def get_document(day):
+    document = cache.get(_key(day))
+    if document is None:
+        programme = DailyProgramme.objects.filter(date=day).first()
+        if programme is None:
+            document = rebuild(day)
+        else:
+            document = programme.document
+            degradation.remember(last_good_key(day), document)
+        cache.set(_key(day), document, timeout=settings.PROGRAMME_CACHE_TIMEOUT)
+    return document
+
+
+def rebuild(day):
+    screenings = Screening.objects.filter(start_time__date=day).order_by('start_time', 'pk').annotate(
+        reserved_count=Count('reservation')).values(
+        'id', 'start_time', 'price', 'movie_id', 'movie__title', 'movie__duration_minutes', 'room_id', 'room__name',
+        'reserved_count',
+        capacity=F('room__rows_count') * F('room__seats_per_row_count') - F('room__blocked_seats_count'))
+    document = json.dumps({'date': day, 'screenings': [{
+        'id': s['id'],
+        'start_time': s['start_time'],
+        'price': s['price'],
+        'movie': {'id': s['movie_id'], 'title': s['movie__title'], 'duration_minutes': s['movie__duration_minutes']},
+        'room': {'id': s['room_id'], 'name': s['room__name']},
+        'seats_left': s['capacity'] - s['reserved_count'],
+    } for s in screenings]}, cls=DjangoJSONEncoder)
+    DailyProgramme.objects.update_or_create(date=day, defaults={'document': document})
+    cache.set(_key(day), document, timeout=settings.PROGRAMME_CACHE_TIMEOUT)
+    # outlives invalidations, served when the database cannot rebuild the document in time
+    degradation.remember(last_good_key(day), document)
+    return document
+
+
+def invalidate(day):
+    DailyProgramme.objects.filter(date=day).delete()
+    cache.delete(_key(day))
+
+
+def reservations_changed(day):
+    """ Invalidates the day now and once the transaction commits, dropping a document a concurrent read stored
+    from the state before the commit """
+    invalidate(day)
+    sharding.on_commit(lambda: invalidate(day))
+
+
+def schedule_changed(*days):
+    for day in set(days):
+        invalidate(day)
+        sharding.on_commit(lambda d=day: rebuild(d))
+
+
+def last_good_key(day):
+    return 'programme:{}'.format(day)
+
+
+def _key(day):
+    return 'programme:{}:{}'.format(sharding.current_db(), day)
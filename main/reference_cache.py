@@ -0,0 +1,91 @@
+""" Process-local cache of the reference rows screening writes resolve over and over: rooms and movies.
+
+Each process keeps the REFERENCE_CACHE_SIZE most recently used rows. Saving or deleting a row drops the local
+entries of its model and bumps the model's version in the shared Django cache, again once the transaction
+commits; other processes compare their version with the shared one at most every REFERENCE_CACHE_CHECK_SECONDS.
+Rows read inside a transaction may be uncommitted, so such reads neither use nor fill the cache.
+Queryset updates bypass the signals and need an explicit ``invalidate``. """
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # (model label, database alias, pk) -> instance
+_versions = {}  # model label -> (shared version, time it was checked)
+
+
+def get(model, pk):
+    """ The row of the model with the pk, raising model.DoesNotExist like QuerySet.get """
+    pk = model._meta.pk.to_python(pk)
+    alias = router.db_for_read(model)
+    if transaction.get_connection(alias).in_atomic_block:
+        return model.objects.using(alias).get(pk=pk)
+    label = model._meta.label
+    version = _check_version(label)
+    key = (label, alias, pk)
+    with _lock:
+        instance = _entries.get(key)
+        if instance is not None:
+            _entries.move_to_end(key)
+            return copy.copy(instance)
+    instance = model.objects.using(alias).get(pk=pk)
+    with _lock:
+        # not stored when the model was invalidated while it was read
+        if _versions.get(label, (None,))[0] == version:
+            _entries[key] = instance
+            while len(_entries) > settings.REFERENCE_CACHE_SIZE:
+                _entries.popitem(last=False)
+    return copy.copy(instance)
+
+
+def invalidate(model):
+    label = model._meta.label
+    key = _version_key(label)
+    cache.add(key, 0, timeout=None)
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        # evicted right after the add
+        version = None
+    with _lock:
+        _forget(label)
+        _versions[label] = (version, time.monotonic())
+
+
+def changed(model, using):
+    """ Invalidates the model now and after the transaction of the change commits """
+    invalidate(model)
+    transaction.on_commit(lambda: invalidate(model), using=using)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _versions.clear()
+
+
+def _check_version(label):
+    with _lock:
+        version, checked = _versions.get(label, (None, None))
+        if checked is not None and time.monotonic() - checked < settings.REFERENCE_CACHE_CHECK_SECONDS:
+            return version
+    shared_version = cache.get(_version_key(label), 0)
+    with _lock:
+        if shared_version != version:
+            _forget(label)
+        _versions[label] = (shared_version, time.monotonic())
+    return shared_version
+
+
+def _forget(label):
+    for key in [key for key in _entries if key[0] == label]:
+        del _entries[key]
+
+
+def _version_key(label):
+    return 'reference-cache:{}'.format(label)
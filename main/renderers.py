@@ -0,0 +1,47 @@
+from rest_framework import renderers
+
+from main.seat_map import SeatMap
+
+
+class SeatMapRLERenderer(renderers.BaseRenderer):
+    """ Renders a SeatMap as runs of available and reserved seats """
+    media_type = 'application/vnd.cinema.seatmap-rle'
+    format = 'rle'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, SeatMap):
+            return data.to_rle()
+        return renderers.JSONRenderer().render(data)
+
+
+class SeatMapBitmapRenderer(renderers.BaseRenderer):
+    """ Renders a SeatMap as a base64 encoded bitmap with one bit per seat """
+    media_type = 'application/vnd.cinema.seatmap-bitmap'
+    format = 'bitmap'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, SeatMap):
+            return data.to_bitmap()
+        return renderers.JSONRenderer().render(data)
+
+
+class CSVRenderer(renderers.BaseRenderer):
+    """ Media type of streamed CSV exports, the body is produced by main.export """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return renderers.JSONRenderer().render(data)
+
+
+class JSONLinesRenderer(renderers.BaseRenderer):
+    """ Media type of streamed JSON Lines exports, the body is produced by main.export """
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return renderers.JSONRenderer().render(data)
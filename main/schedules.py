@@ -0,0 +1,107 @@
+""" Recurring screening schedules.
+
+A schedule is validated against the screenings and the other schedules of its room with a single sweep over
+the sorted intervals of all occurrences, instead of one query per occurrence. Its occurrences become
+Screening rows only SCHEDULE_WINDOW_DAYS ahead, by the materialize_schedules command run daily. """
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from main import sharding, stats, programme, outbox, compression
+from main.models import Screening, ScreeningSchedule, ChangeLogEntry
+
+
+def occurrences(schedule, first_day, last_day):
+    """ Start times of the screenings of the schedule between the days, both included """
+    first_day = max(first_day, schedule.first_day)
+    last_day = min(last_day, schedule.last_day)
+    start_times = schedule.start_times()
+    for offset in range((last_day - first_day).days + 1):
+        day = first_day + timedelta(days=offset)
+        for start_time in start_times:
+            yield timezone.make_aware(datetime.combine(day, start_time))
+
+
+def unmaterialized():
+    """ Schedules with occurrences that are not screenings yet """
+    return ScreeningSchedule.objects.filter(
+        Q(materialized_until__isnull=True) | Q(materialized_until__lt=F('last_day')))
+
+
+def pending_occurrences(room, first_day, last_day, exclude=None):
+    """ Intervals of the occurrences of the room's schedules that are not materialized yet """
+    schedules = ScreeningSchedule.objects.filter(room=room, first_day__lte=last_day, last_day__gte=first_day) \
+        .filter(Q(materialized_until__isnull=True) | Q(materialized_until__lt=last_day)).select_related('movie')
+    if exclude is not None:
+        schedules = schedules.exclude(pk=exclude.pk)
+    for schedule in schedules:
+        duration = timedelta(minutes=schedule.movie.duration_minutes + Screening.IDLE_TIME)
+        pending_from = first_day
+        if schedule.materialized_until is not None:
+            pending_from = max(first_day, schedule.materialized_until + timedelta(days=1))
+        for start in occurrences(schedule, pending_from, last_day):
+            yield start, start + duration
+
+
+def find_intersection(schedule):
+    """ Returns the start of the first occurrence of the unsaved schedule intersecting another screening
+    of the room, or None """
+    duration = timedelta(minutes=schedule.movie.duration_minutes + Screening.IDLE_TIME)
+    new = [(start, start + duration, True) for start in occurrences(schedule, schedule.first_day, schedule.last_day)]
+    window_start = timezone.make_aware(datetime.combine(schedule.first_day, datetime.min.time()))
+    window_end = timezone.make_aware(datetime.combine(schedule.last_day + timedelta(days=1), datetime.max.time()))
+    existing = Screening.objects.filter(room=schedule.room, start_time__gte=window_start - timedelta(days=1),
+                                        start_time__lte=window_end) \
+        .annotate(duration=F('movie__duration_minutes')).values_list('start_time', 'duration')
+    intervals = new + [(start, start + timedelta(minutes=minutes + Screening.IDLE_TIME), False)
+                       for start, minutes in existing]
+    intervals += [(start, end, False) for start, end in
+                  pending_occurrences(schedule.room, schedule.first_day, schedule.last_day, exclude=schedule)]
+    intervals.sort()
+
+    latest_end = latest_is_new = None
+    for start, end, is_new in intervals:
+        if latest_end is not None and start < latest_end and (is_new or latest_is_new):
+            return start
+        if latest_end is None or end > latest_end:
+            latest_end, latest_is_new = end, is_new
+    return None
+
+
+def materialize(until=None):
+    """ Creates the screenings of all schedules of the active shard up to the given day.
+    Returns the number of created screenings """
+    until = until or timezone.localdate() + timedelta(days=settings.SCHEDULE_WINDOW_DAYS)
+    pending = ScreeningSchedule.objects.filter(Q(materialized_until__isnull=True) |
+                                               Q(materialized_until__lt=F('last_day')))
+    return sum(materialize_schedule(schedule, until) for schedule in pending.select_related('room', 'movie'))
+
+
+@sharding.atomic
+def materialize_schedule(schedule, until):
+    """ Creates the screenings of the schedule up to the given day. The schedule is read again under a lock, so
+    concurrent runs never create the same occurrences twice """
+    schedule = ScreeningSchedule.objects.select_for_update(of=('self',)).select_related('room', 'movie') \
+        .get(pk=schedule.pk)
+    first_day = schedule.first_day
+    if schedule.materialized_until is not None:
+        first_day = schedule.materialized_until + timedelta(days=1)
+    last_day = min(until, schedule.last_day)
+    if first_day > last_day:
+        return 0
+    Screening.objects.bulk_create(
+        Screening(room=schedule.room, movie=schedule.movie, price=schedule.price, start_time=start, schedule=schedule)
+        for start in occurrences(schedule, first_day, last_day))
+    compression.invalidate(Screening)
+    schedule.materialized_until = last_day
+    schedule.save(update_fields=['materialized_until'])
+
+    # bulk_create does not set the primary keys on every database, so the rows are read back
+    created = list(Screening.objects.filter(schedule=schedule, start_time__date__range=(first_day, last_day))
+                   .select_related('room'))
+    stats.screenings_created(created)
+    programme.schedule_changed(*(screening.day for screening in created))
+    outbox.record_many(created, ChangeLogEntry.CREATED)
+    return len(created)
@@ -0,0 +1,137 @@
+""" Compact representations of the seat availability of a screening.
+
+The room is a rectangular grid, so availability is a sequence of flags in row-major order
+(row 1 seat 1, row 1 seat 2, ...). It is encoded either as runs, e.g. ``10x15:20A1R129A``
+(20 available seats, 1 reserved, 129 available), or as a bitmap, e.g. ``10x15:<base64>``
+with one bit per seat, most significant bit first, 1 meaning available.
+
+A map can be restricted to seats of some categories, e.g. accessible ones; blocked seats are never available. """
+import base64
+import re
+
+from main.models import Reservation, Seat
+
+AVAILABLE = 'A'
+RESERVED = 'R'
+
+_HEADER_RE = re.compile(r'^(\d+)x(\d+):(.*)$')
+_RUN_RE = re.compile(r'(\d+)([{}{}])'.format(AVAILABLE, RESERVED))
+
+
+def category_mask(names):
+    """ Category bits of comma separated category names, raises ValueError for unknown ones """
+    mask = 0
+    for name in filter(None, names.split(',')):
+        if name not in Seat.CATEGORIES or Seat.CATEGORIES[name] == Seat.BLOCKED:
+            raise ValueError('Unknown seat category: {}'.format(name))
+        mask |= Seat.CATEGORIES[name]
+    return mask
+
+
+class SeatMap:
+    def __init__(self, rows_count, seats_per_row_count, available):
+        self.rows_count = rows_count
+        self.seats_per_row_count = seats_per_row_count
+        self.available = available
+
+    @classmethod
+    def for_room(cls, room, category=0):
+        """ Seats of the room that are not blocked and have all bits of category """
+        # maps the category byte of every seat to its availability in one pass
+        table = bytes(int(not bits & Seat.BLOCKED and bits & category == category) for bits in range(256))
+        return cls(room.rows_count, room.seats_per_row_count,
+                   bytearray(room.get_seat_categories().translate(table)))
+
+    @classmethod
+    def for_screening(cls, screening, category=0):
+        seat_map = cls.for_room(screening.room, category)
+        reserved = Reservation.objects.filter(screening=screening).values_list('seat__row', 'seat__number')
+        for row, number in reserved:
+            seat_map.available[(row - 1) * seat_map.seats_per_row_count + number - 1] = 0
+        return seat_map
+
+    def is_available(self, row, number):
+        return bool(self.available[(row - 1) * self.seats_per_row_count + number - 1])
+
+    def row(self, row):
+        start = (row - 1) * self.seats_per_row_count
+        return self.available[start:start + self.seats_per_row_count]
+
+    def free_runs(self):
+        """ Index of the runs of adjacent available seats, as (row, first seat number, length) """
+        runs = []
+        for row in range(1, self.rows_count + 1):
+            start = None
+            for number, flag in enumerate(self.row(row), start=1):
+                if flag and start is None:
+                    start = number
+                elif not flag and start is not None:
+                    runs.append((row, start, number - start))
+                    start = None
+            if start is not None:
+                runs.append((row, start, self.seats_per_row_count + 1 - start))
+        return runs
+
+    def best_block(self, count):
+        """ Finds the block of count adjacent available seats closest to the center of the room.
+
+        Returns (row, first seat number) or None when no row has such a block. """
+        center_row = (self.rows_count + 1) / 2
+        center_seat = (self.seats_per_row_count + 1) / 2
+        best = None
+        best_distance = None
+        for row, start, length in self.free_runs():
+            if length < count:
+                continue
+            # the most central position of the block inside this run
+            first = min(max(int(round(center_seat - (count - 1) / 2)), start), start + length - count)
+            distance = abs(row - center_row) + abs(first + (count - 1) / 2 - center_seat)
+            if best_distance is None or distance < best_distance:
+                best, best_distance = (row, first), distance
+        return best
+
+    def to_rle(self):
+        runs = []
+        count = 0
+        previous = None
+        for flag in self.available:
+            if flag != previous and count:
+                runs.append('{}{}'.format(count, AVAILABLE if previous else RESERVED))
+                count = 0
+            previous = flag
+            count += 1
+        if count:
+            runs.append('{}{}'.format(count, AVAILABLE if previous else RESERVED))
+        return self._header() + ''.join(runs)
+
+    def to_bitmap(self):
+        packed = bytearray((len(self.available) + 7) // 8)
+        for index, flag in enumerate(self.available):
+            if flag:
+                packed[index // 8] |= 0x80 >> (index % 8)
+        return self._header() + base64.b64encode(bytes(packed)).decode('ascii')
+
+    @classmethod
+    def from_rle(cls, encoded):
+        rows_count, seats_per_row_count, body = cls._parse_header(encoded)
+        available = bytearray()
+        for count, flag in _RUN_RE.findall(body):
+            available.extend((b'\x01' if flag == AVAILABLE else b'\x00') * int(count))
+        return cls(rows_count, seats_per_row_count, available)
+
+    @classmethod
+    def from_bitmap(cls, encoded):
+        rows_count, seats_per_row_count, body = cls._parse_header(encoded)
+        packed = base64.b64decode(body)
+        available = bytearray((packed[i // 8] >> (7 - i % 8)) & 1 for i in range(rows_count * seats_per_row_count))
+        return cls(rows_count, seats_per_row_count, available)
+
+    def _header(self):
+        return '{}x{}:'.format(self.rows_count, self.seats_per_row_count)
+
+    @staticmethod
+    def _parse_header(encoded):
+        match = _HEADER_RE.match(encoded)
+        if not match:
+            raise ValueError('Invalid seat map: {}'.format(encoded))
+        return int(match.group(1)), int(match.group(2)), match.group(3)
@@ -1,12 +1,40 @@
+import json
 from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.db import models
 from django.utils import timezone
 from rest_framework import serializers
-from rest_framework.validators import UniqueValidator
+from rest_framework.validators import UniqueValidator, UniqueTogetherValidator
 
-from main.models import TheaterRoom, Movie, Screening
+from main import stats, programme, sharding, outbox, schedules, reference_cache
+from main.models import TheaterRoom, Movie, Screening, Reservation, Seat, ScreeningStats, MovieStats, DailyStats, \
+    ChangeLogEntry, ScreeningSchedule, Checkout
+from main.fieldsets import SparseFieldsSerializerMixin
+from main.seat_map import SeatMap
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ Resolves rooms and movies through the process-local reference cache """
+
+    def to_internal_value(self, data):
+        try:
+            return reference_cache.get(self.get_queryset().model, data)
+        except ObjectDoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError, ValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class CinemaHyperlinkedIdentityField(serializers.HyperlinkedIdentityField):
+    """ Link to an object of a cinema shard. Ids are only unique within a cinema, so the link selects the cinema """
+    loaded_fields = ('room__cinema',)
+
+    def get_url(self, obj, view_name, request, format):
+        url = super().get_url(obj, view_name, request, format)
+        return '{}?cinema={}'.format(url, obj.room.cinema_id)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -40,13 +68,79 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class TheaterRoomSerializer(serializers.ModelSerializer):
+class UserFilterSerializer(serializers.Serializer):
+    """ Query parameters of the admin user directory, days are inclusive """
+    search = serializers.CharField(max_length=150, required=False)
+    joined_from = serializers.DateField(required=False)
+    joined_until = serializers.DateField(required=False)
+    is_staff = serializers.BooleanField(required=False)
+
+    def filter(self, queryset):
+        data = self.validated_data
+        if data.get('search'):
+            # prefix matches only, so the expression indexes of migration 0015 can be used
+            queryset = queryset.filter(models.Q(username__istartswith=data['search']) |
+                                       models.Q(email__istartswith=data['search']))
+        if 'joined_from' in data:
+            queryset = queryset.filter(date_joined__gte=_start_of_day(data['joined_from']))
+        if 'joined_until' in data:
+            queryset = queryset.filter(date_joined__lt=_start_of_day(data['joined_until'] + timedelta(days=1)))
+        if 'is_staff' in data:
+            queryset = queryset.filter(is_staff=data['is_staff'])
+        return queryset
+
+
+def _start_of_day(day):
+    return timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.min.time()))
+
+
+class TheaterRoomSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = TheaterRoom
-        fields = ('id', 'name', 'rows_count', 'seats_per_row_count')
+        fields = ('id', 'cinema', 'name', 'rows_count', 'seats_per_row_count')
+
 
+def _seats_field():
+    return serializers.ListField(child=serializers.ListField(child=serializers.IntegerField(min_value=1),
+                                                             min_length=2, max_length=2), required=False)
 
-class MovieSerializer(serializers.ModelSerializer):
+
+class SeatCategoriesSerializer(serializers.Serializer):
+    """ Seats of each category of a room as [row, number] pairs. Saving replaces all categories of the room """
+    vip = _seats_field()
+    accessible = _seats_field()
+    blocked = _seats_field()
+
+    def to_representation(self, room):
+        categories = room.get_seat_categories()
+        seats_per_row = room.seats_per_row_count
+        return {name: [[index // seats_per_row + 1, index % seats_per_row + 1]
+                       for index, bits in enumerate(categories) if bits & bit]
+                for name, bit in Seat.CATEGORIES.items()}
+
+    def validate(self, attrs):
+        for name, seats in attrs.items():
+            for row, number in seats:
+                if row > self.instance.rows_count or number > self.instance.seats_per_row_count:
+                    raise serializers.ValidationError(
+                        {name: 'Row {} seat {} is not in the room.'.format(row, number)})
+        return attrs
+
+    def update(self, room, validated_data):
+        categories = bytearray(room.rows_count * room.seats_per_row_count)
+        for name, seats in validated_data.items():
+            for row, number in seats:
+                categories[(row - 1) * room.seats_per_row_count + number - 1] |= Seat.CATEGORIES[name]
+        room.seat_categories = bytes(categories) if any(categories) else b''
+        room.blocked_seats_count = sum(1 for bits in categories if bits & Seat.BLOCKED)
+        with sharding.atomic():
+            room.save(update_fields=['seat_categories', 'blocked_seats_count'])
+            stats.capacity_changed(room)
+            programme.schedule_changed(*(screening.day for screening in Screening.objects.filter(room=room)))
+        return room
+
+
+class MovieSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     title = serializers.CharField(max_length=Movie.TITLE_MAX_LENGTH)
     duration_minutes = serializers.IntegerField(min_value=10, max_value=500)
 
@@ -55,19 +149,25 @@ class MovieSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'duration_minutes')
 
     def update(self, instance, validated_data):
-        screenings = Screening.objects.filter(movie=instance)
-        if screenings:
+        if sharding.exists_on_any_shard(Screening.objects.filter(movie=instance)):
             raise models.deletion.ProtectedError(instance, 'The movie cannot be updated while it is in screenings')
+        # the occurrences still to be materialized were validated against the current duration
+        if sharding.exists_on_any_shard(schedules.unmaterialized().filter(movie=instance)):
+            raise models.deletion.ProtectedError(
+                instance, 'The movie cannot be updated while it is in screening schedules')
         return super().update(instance, validated_data)
 
 
-class ScreeningSerializer(serializers.ModelSerializer):
+class ScreeningSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    room = CachedPrimaryKeyRelatedField(queryset=TheaterRoom.objects.all())
+    movie = CachedPrimaryKeyRelatedField(queryset=Movie.objects.all())
     price = serializers.IntegerField(min_value=1)
-    available_seats = serializers.HyperlinkedIdentityField(view_name='available-seats')
+    available_seats = CinemaHyperlinkedIdentityField(view_name='available-seats')
+    cinema = serializers.IntegerField(source='room.cinema_id', read_only=True)
 
     class Meta:
         model = Screening
-        fields = ('id', 'room', 'movie', 'start_time', 'price', 'available_seats')
+        fields = ('id', 'cinema', 'room', 'movie', 'start_time', 'price', 'available_seats')
 
     def validate(self, attrs):
         if 'start_time' in attrs:
@@ -88,7 +188,162 @@ class ScreeningSerializer(serializers.ModelSerializer):
             start_time__day=new_start.day
         )
         for s in screens_start_same_day:
+            s.movie = reference_cache.get(Movie, s.movie_id)
             if new_start < s.start_time < new_end \
                     or new_start < s.end_time < new_end \
                     or s.start_time < new_start < s.end_time:
                 raise serializers.ValidationError({'start_time': "Screenings should not intersect."})
+        day = timezone.localtime(new_start).date()
+        for start, end in schedules.pending_occurrences(validated_data['room'], day, day):
+            if start < new_end and new_start < end:
+                raise serializers.ValidationError({'start_time': "Screenings should not intersect."})
+
+
+class BulkPriceSerializer(serializers.Serializer):
+    """ Screenings selected by movie, room and day range, and either a new price or a change in percent """
+    movie = CachedPrimaryKeyRelatedField(queryset=Movie.objects.all(), required=False)
+    room = CachedPrimaryKeyRelatedField(queryset=TheaterRoom.objects.all(), required=False)
+    first_day = serializers.DateField(required=False)
+    last_day = serializers.DateField(required=False)
+    price = serializers.IntegerField(min_value=1, required=False)
+    percent = serializers.IntegerField(min_value=-99, max_value=1000, required=False)
+
+    FILTERS = ('movie', 'room', 'first_day', 'last_day')
+
+    def validate(self, attrs):
+        if not any(name in attrs for name in self.FILTERS):
+            raise serializers.ValidationError('Select the screenings by movie, room, first_day or last_day.')
+        if ('price' in attrs) == ('percent' in attrs):
+            raise serializers.ValidationError('Expected either price or percent.')
+        if attrs.get('first_day') and attrs.get('last_day') and attrs['first_day'] > attrs['last_day']:
+            raise serializers.ValidationError({'last_day': 'The last day cannot be before the first day.'})
+        return attrs
+
+    def filter(self, queryset):
+        lookups = {'movie': 'movie', 'room': 'room', 'first_day': 'start_time__date__gte',
+                   'last_day': 'start_time__date__lte'}
+        return queryset.filter(**{lookups[name]: value for name, value in self.validated_data.items()
+                                  if name in lookups})
+
+    def pending_schedules(self, queryset):
+        """ Primary keys of the schedules of the queryset with occurrences that are not screenings yet on the selected
+        days. The price of a schedule applies to all its pending occurrences, so they must all be selected """
+        data = self.validated_data
+        queryset = queryset.filter(**{name: data[name] for name in ('movie', 'room') if name in data})
+        if 'first_day' in data:
+            queryset = queryset.filter(last_day__gte=data['first_day'])
+        if 'last_day' in data:
+            queryset = queryset.filter(first_day__lte=data['last_day'])
+        selected = []
+        for schedule in queryset.order_by('pk'):
+            pending_from = schedule.first_day
+            if schedule.materialized_until is not None:
+                pending_from = max(pending_from, schedule.materialized_until + timedelta(days=1))
+            first_day, last_day = data.get('first_day', pending_from), data.get('last_day', schedule.last_day)
+            if pending_from > last_day:
+                continue
+            if pending_from < first_day or schedule.last_day > last_day:
+                raise serializers.ValidationError(
+                    'The days select part of the occurrences of schedule {} that are not screenings yet, from {} '
+                    'to {}.'.format(schedule.pk, pending_from, schedule.last_day))
+            selected.append(schedule.pk)
+        return selected
+
+
+class ScreeningScheduleSerializer(serializers.ModelSerializer):
+    room = CachedPrimaryKeyRelatedField(queryset=TheaterRoom.objects.all())
+    movie = CachedPrimaryKeyRelatedField(queryset=Movie.objects.all())
+    price = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = ScreeningSchedule
+        fields = ('id', 'room', 'movie', 'price', 'first_day', 'last_day', 'times', 'materialized_until')
+        read_only_fields = ('materialized_until',)
+
+    def validate_times(self, times):
+        try:
+            start_times = ScreeningSchedule(times=times).start_times()
+        except ValueError:
+            raise serializers.ValidationError('Expected comma separated times as HH:MM.')
+        for start_time in start_times:
+            if start_time.hour < 8:
+                raise serializers.ValidationError('Screening cannot start before 8am.')
+            if start_time > timezone.datetime(1, 1, 1, 23, 0, 0).time():
+                raise serializers.ValidationError('Screening cannot start later than 11pm.')
+        return times
+
+    def validate(self, attrs):
+        if attrs['first_day'] > attrs['last_day']:
+            raise serializers.ValidationError({'last_day': 'The last day cannot be before the first day.'})
+        if (attrs['last_day'] - attrs['first_day']).days >= settings.SCHEDULE_MAX_DAYS:
+            raise serializers.ValidationError(
+                {'last_day': 'A schedule cannot cover more than {} days.'.format(settings.SCHEDULE_MAX_DAYS)})
+        if schedules.find_intersection(ScreeningSchedule(**attrs)) is not None:
+            raise serializers.ValidationError({'times': 'Screenings should not intersect.'})
+        return super().validate(attrs)
+
+
+class ReservationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Reservation
+        fields = ('id', 'screening', 'seat', 'reservation_time', 'purchase_time', 'price_paid')
+        read_only_fields = ('reservation_time', 'purchase_time', 'price_paid')
+        validators = [
+            UniqueTogetherValidator(queryset=Reservation.objects.all(), fields=('screening', 'seat'),
+                                    message='The seat is already reserved for this screening.')
+        ]
+
+    def validate(self, attrs):
+        if attrs['seat'].room_id != attrs['screening'].room_id:
+            raise serializers.ValidationError({'seat': 'The seat is not in the screening room.'})
+        room = reference_cache.get(TheaterRoom, attrs['seat'].room_id)
+        if not SeatMap.for_room(room).is_available(attrs['seat'].row, attrs['seat'].number):
+            raise serializers.ValidationError({'seat': 'The seat is blocked.'})
+        return super().validate(attrs)
+
+    def create(self, validated_data):
+        validated_data['user'] = self.context['request'].user
+        validated_data['reservation_time'] = timezone.now()
+        reservation = super().create(validated_data)
+        stats.reservation_created(reservation)
+        programme.reservations_changed(reservation.screening.day)
+        outbox.record(reservation, ChangeLogEntry.CREATED)
+        return reservation
+
+
+class CheckoutSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(view_name='checkouts-detail')
+
+    class Meta:
+        model = Checkout
+        fields = ('id', 'url', 'reservation', 'amount', 'status', 'attempts', 'created_at', 'completed_at', 'ticket',
+                  'error')
+
+
+class ScreeningStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScreeningStats
+        fields = ('screening', 'capacity', 'reserved_count', 'sold_count', 'revenue', 'occupancy')
+
+
+class MovieStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MovieStats
+        fields = ('movie', 'capacity', 'reserved_count', 'sold_count', 'revenue', 'occupancy')
+
+
+class DailyStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyStats
+        fields = ('date', 'capacity', 'reserved_count', 'sold_count', 'revenue', 'occupancy')
+
+
+class ChangeLogEntrySerializer(serializers.ModelSerializer):
+    payload = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChangeLogEntry
+        fields = ('id', 'position', 'created_at', 'entity', 'entity_id', 'action', 'payload')
+
+    def get_payload(self, entry):
+        return json.loads(entry.payload)
@@ -0,0 +1,148 @@
+""" Placement of each cinema's data on one of the databases listed in CINEMA_SHARDS.
+
+Cinemas, movies and users are reference data: they are written to the default database and copied to
+every other shard, so the foreign keys of rooms, screenings and reservations hold within a shard.
+All other models of the app live on the shard of the active cinema, which CinemaShardMiddleware
+activates for requests carrying ``?cinema=<id>``. Without an active cinema the default database is used
+and listings can merge the results of all shards. """
+import functools
+import heapq
+import threading
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import JsonResponse
+
+SHARD_CACHE_TIMEOUT = 60 * 60
+
+_active = threading.local()
+
+
+def get_active_shard():
+    return getattr(_active, 'alias', None)
+
+
+def current_db():
+    return get_active_shard() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def shard(alias):
+    previous = get_active_shard()
+    _active.alias = alias
+    try:
+        yield alias
+    finally:
+        _active.alias = previous
+
+
+def shard_for_cinema(cinema_pk):
+    """ Database alias of the cinema or None when the cinema does not exist """
+    key = 'cinema-shard:{}'.format(cinema_pk)
+    alias = cache.get(key)
+    if alias is None:
+        from main.models import Cinema
+        alias = Cinema.objects.using(DEFAULT_DB_ALIAS).filter(pk=cinema_pk).values_list('shard', flat=True).first()
+        if alias is not None:
+            cache.set(key, alias, timeout=SHARD_CACHE_TIMEOUT)
+    return alias
+
+
+def forget_cinema(cinema_pk):
+    cache.delete('cinema-shard:{}'.format(cinema_pk))
+
+
+def atomic(func=None):
+    """ transaction.atomic on the database of the active shard, as a context manager or a decorator """
+    if func is None:
+        return transaction.atomic(using=current_db())
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with transaction.atomic(using=current_db()):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def on_commit(func):
+    """ Runs func on the shard that is active now, after the transaction of that shard commits """
+    alias = current_db()
+
+    def run():
+        with shard(alias):
+            func()
+
+    transaction.on_commit(run, using=alias)
+
+
+def merged(queryset, *ordering, limit=None):
+    """ Iterates the queryset on every shard, merging the results in the given field order.
+    The filters, the order and the limit run on each shard, which streams its rows, so at most ``limit`` rows
+    are read from each shard. Primary keys are only unique within a shard """
+    querysets = [queryset.using(alias).order_by(*ordering) for alias in settings.CINEMA_SHARDS]
+    if limit is not None:
+        querysets = [shard_queryset[:limit] for shard_queryset in querysets]
+    rows = heapq.merge(*(shard_queryset.iterator() for shard_queryset in querysets),
+                       key=lambda obj: tuple(getattr(obj, field) for field in ordering))
+    return islice(rows, limit)
+
+
+def is_reference_model(model):
+    return model._meta.app_label != 'main' or model._meta.model_name in ('cinema', 'movie')
+
+
+class CinemaShardRouter:
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # reference rows exist on every shard
+        return obj1._state.db == obj2._state.db or is_reference_model(type(obj1)) or is_reference_model(type(obj2))
+
+    @staticmethod
+    def _db_for(model, instance=None, **hints):
+        if is_reference_model(model):
+            return DEFAULT_DB_ALIAS
+        if instance is not None and instance._state.db and not is_reference_model(type(instance)):
+            return instance._state.db
+        return current_db()
+
+
+class CinemaShardMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        cinema_pk = request.GET.get('cinema')
+        if not cinema_pk:
+            return self.get_response(request)
+        alias = shard_for_cinema(cinema_pk) if cinema_pk.isdigit() else None
+        if alias is None:
+            return JsonResponse(status=404, data={'detail': 'Unknown cinema.'})
+        with shard(alias):
+            return self.get_response(request)
+
+
+def exists_on_any_shard(queryset):
+    return any(queryset.using(alias).exists() for alias in settings.CINEMA_SHARDS)
+
+
+def replicate(instance):
+    """ Copies a reference row from the default database to the other shards """
+    for alias in settings.CINEMA_SHARDS:
+        if alias != DEFAULT_DB_ALIAS:
+            instance.save_base(using=alias, raw=True)
+    instance._state.db = DEFAULT_DB_ALIAS
+
+
+def replicate_delete(instance):
+    for alias in settings.CINEMA_SHARDS:
+        if alias != DEFAULT_DB_ALIAS:
+            type(instance)._base_manager.using(alias).filter(pk=instance.pk).delete()
@@ -0,0 +1,83 @@
+from django.contrib.auth.models import User, Group, Permission
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import ProtectedError
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from main import backends, sharding, reference_cache, compression
+from main.models import Cinema, Movie, Screening, TheaterRoom
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    backends.invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_relation_changed(sender, instance, action, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, User):
+        backends.invalidate_user(instance.pk)
+    else:
+        # changed from the side of the group or permission, it may affect any user
+        backends.invalidate_all()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        backends.invalidate_all()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def group_or_permission_changed(sender, **kwargs):
+    backends.invalidate_all()
+
+
+@receiver(post_save, sender=Cinema)
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=User)
+def reference_saved(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        sharding.replicate(instance)
+    if sender is Cinema:
+        sharding.forget_cinema(instance.pk)
+
+
+@receiver(post_delete, sender=Cinema)
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=User)
+def reference_deleted(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        sharding.replicate_delete(instance)
+    if sender is Cinema:
+        sharding.forget_cinema(instance.pk)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=TheaterRoom)
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=TheaterRoom)
+def cached_reference_changed(sender, using, **kwargs):
+    reference_cache.changed(sender, using)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=TheaterRoom)
+@receiver(post_save, sender=Screening)
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=TheaterRoom)
+@receiver(post_delete, sender=Screening)
+def listed_model_changed(sender, using, **kwargs):
+    compression.invalidate(sender, using)
+
+
+@receiver(pre_delete, sender=Movie)
+def movie_deleting(sender, instance, using, **kwargs):
+    # the deletion only checks the screenings on its own database
+    if using == DEFAULT_DB_ALIAS and sharding.exists_on_any_shard(Screening.objects.filter(movie=instance)):
+        raise ProtectedError('The movie cannot be deleted while it is in screenings', [instance])
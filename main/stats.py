@@ -0,0 +1,139 @@
+""" Occupancy and revenue aggregates per screening, movie and day.
+
+Writes of reservations and screenings apply their deltas to the aggregate rows in the same transaction.
+A missing row is computed from scratch instead, so the aggregates are correct without a backfill.
+Archived screenings keep counting towards the movie and day aggregates. Blocked seats do not count as capacity.
+``reconcile`` recomputes every row and is run periodically by the reconcile_stats command. """
+from collections import defaultdict
+
+from django.db import IntegrityError
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+from main import sharding
+from main.models import Screening, Reservation, ScreeningStats, MovieStats, DailyStats, ArchivedScreening, \
+    ArchivedReservation
+
+ROOM_CAPACITY = F('room__rows_count') * F('room__seats_per_row_count') - F('room__blocked_seats_count')
+RESERVATION_AGGREGATES = {'reserved_count': Count('id'), 'sold_count': Count('purchase_time'),
+                          'revenue': Sum('price_paid')}
+SOURCES = ((Screening, Reservation), (ArchivedScreening, ArchivedReservation))
+
+
+def reservation_created(reservation):
+    _apply(reservation.screening, reserved_count=1)
+
+
+def reservation_purchased(reservation):
+    _apply(reservation.screening, sold_count=1, revenue=reservation.price_paid)
+
+
+def screening_created(screening):
+    _apply(screening, capacity=screening.room.capacity)
+
+
+def screenings_created(screenings):
+    """ Refreshes once each movie and day aggregate the bulk created screenings contribute to """
+    refreshed = set()
+    for screening in screenings:
+        for model, key, screenings_filter in _scopes(screening)[1:]:
+            if (model, tuple(key.items())) not in refreshed:
+                refreshed.add((model, tuple(key.items())))
+                _refresh_scope(model, key, screenings_filter)
+
+
+def capacity_changed(room):
+    """ Updates the aggregates of the room's screenings after seats of the room were blocked or unblocked,
+    the screening rows with a single UPDATE and each movie and day aggregate once """
+    screenings = Screening.objects.filter(room=room)
+    room_stats = ScreeningStats.objects.filter(screening__in=screenings)
+    if room.capacity:
+        room_stats.update(capacity=room.capacity)
+        # rows that were never computed, e.g. of screenings that had no capacity
+        for screening in screenings.exclude(pk__in=room_stats.values('screening_id')):
+            _refresh_scope(*_scopes(screening)[0])
+    else:
+        room_stats.delete()
+    screenings_created(screenings.only('movie', 'start_time'))
+
+
+def screening_updated(previous, screening):
+    if (previous.room_id, previous.movie_id, previous.day) != (screening.room_id, screening.movie_id, screening.day):
+        _refresh(previous)
+        _refresh(screening)
+
+
+def screening_deleted(screening):
+    _refresh(screening)
+
+
+def reconcile():
+    """ Recomputes all aggregates, including archived screenings, and removes the rows nothing contributes to """
+    with sharding.atomic():
+        _reconcile(ScreeningStats, 'screening_id', F('pk'), F('screening_id'), sources=SOURCES[:1])
+        _reconcile(MovieStats, 'movie_id', F('movie_id'), F('screening__movie_id'))
+        _reconcile(DailyStats, 'date', TruncDate('start_time'), TruncDate('screening__start_time'))
+
+
+def _scopes(screening):
+    """ Aggregate rows the screening contributes to, with the filter of the screenings each of them covers """
+    day = screening.day
+    return (
+        (ScreeningStats, {'screening_id': screening.pk}, {'pk': screening.pk}),
+        (MovieStats, {'movie_id': screening.movie_id}, {'movie_id': screening.movie_id}),
+        (DailyStats, {'date': day}, {'start_time__date': day}),
+    )
+
+
+def _apply(screening, **deltas):
+    for model, key, screenings_filter in _scopes(screening):
+        increments = {name: F(name) + delta for name, delta in deltas.items()}
+        if model.objects.filter(**key).update(**increments):
+            continue
+        try:
+            with sharding.atomic():
+                model.objects.create(**key, **_compute(screenings_filter))
+        except IntegrityError:
+            # created concurrently by a transaction that could not see this write yet
+            model.objects.filter(**key).update(**increments)
+
+
+def _refresh(screening):
+    for model, key, screenings_filter in _scopes(screening):
+        _refresh_scope(model, key, screenings_filter)
+
+
+def _refresh_scope(model, key, screenings_filter):
+    values = _compute(screenings_filter)
+    if values['capacity']:
+        model.objects.update_or_create(defaults=values, **key)
+    else:
+        model.objects.filter(**key).delete()
+
+
+def _compute(screenings_filter):
+    values = {'capacity': 0, 'reserved_count': 0, 'sold_count': 0, 'revenue': 0}
+    for screening_model, reservation_model in SOURCES:
+        screenings = screening_model.objects.filter(**screenings_filter)
+        _add(values, reservation_model.objects.filter(screening__in=screenings).aggregate(**RESERVATION_AGGREGATES))
+        _add(values, screenings.aggregate(capacity=Sum(ROOM_CAPACITY)))
+    return values
+
+
+def _reconcile(model, key_name, screening_group, reservation_group, sources=SOURCES):
+    rows = defaultdict(lambda: {'capacity': 0, 'reserved_count': 0, 'sold_count': 0, 'revenue': 0})
+    for screening_model, reservation_model in sources:
+        for values in screening_model.objects.annotate(key=screening_group).values('key').annotate(
+                capacity=Sum(ROOM_CAPACITY)):
+            _add(rows[values.pop('key')], values)
+        for values in reservation_model.objects.annotate(key=reservation_group).values('key').annotate(
+                **RESERVATION_AGGREGATES):
+            _add(rows[values.pop('key')], values)
+    model.objects.exclude(**{key_name + '__in': list(rows)}).delete()
+    for key, values in rows.items():
+        model.objects.update_or_create(defaults=values, **{key_name: key})
+
+
+def _add(values, increments):
+    for name, increment in increments.items():
+        values[name] += increment or 0
@@ -0,0 +1,157 @@
+""" Deterministic synthetic datasets for scale tests.
+
+Every value is drawn from one random generator seeded with ``seed``, so the same arguments produce the same rooms,
+screenings and reservations. The data of a run belongs to a new cinema on the active shard; its movies and users
+are reference data and are copied to the other shards like any other reference rows.
+Screenings follow the rules of the API: back to back in each room with Screening.IDLE_TIME between them, starting
+between 8am and 11pm. The share of seats reserved for a screening follows the popularity of its movie, its hour and
+its weekday. Seats, screenings and reservations are generated lazily and written with bulk inserts of batch_size
+rows, so memory does not grow with them. The aggregates are reconciled at the end, change log entries are not
+written. """
+import random
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from main import compression, programme, sharding, stats
+from main.models import Cinema, TheaterRoom, Seat, Movie, Screening, Reservation
+
+BATCH_SIZE = 5000
+FIRST_START_MIN = 8 * 60
+LAST_START_MIN = 23 * 60
+START_STEP_MIN = 5
+ROWS_RANGE = (8, 20)
+SEATS_PER_ROW_RANGE = (10, 30)
+DURATION_RANGE = (80, 180)
+PRICES = (1500, 1800, 2000, 2200, 2500)
+
+# demand per starting hour, relative to prime time
+HOUR_DEMAND = {8: .15, 9: .2, 10: .25, 11: .3, 12: .35, 13: .35, 14: .4, 15: .45, 16: .55, 17: .7, 18: .85,
+               19: 1, 20: 1, 21: .9, 22: .6, 23: .35}
+WEEKEND_DEMAND = 1.3
+PURCHASED_SHARE = .8
+BOOKING_WINDOW_MIN = 14 * 24 * 60
+
+
+def generate(first_day, days, rooms_count, movies_count, users_count, fill=.7, seed=0, batch_size=BATCH_SIZE):
+    """ Creates a cinema on the active shard with its rooms, seats and screenings of ``days`` days from
+    ``first_day``, the movies and users they need, and the reservations of the screenings.
+    ``fill`` is the share of seats reserved for a prime time screening of an average movie.
+    Returns the number of created rows per model name """
+    rng = random.Random(seed)
+    cinema = Cinema.objects.create(name='Synthetic cinema {}'.format(seed), shard=sharding.current_db())
+
+    movie_prefix = 'Synthetic movie {}-'.format(cinema.pk)
+    movies = _create_reference(
+        Movie, (Movie(title=movie_prefix + str(number), duration_minutes=rng.randint(*DURATION_RANGE))
+                for number in range(movies_count)),
+        Movie.objects.filter(title__startswith=movie_prefix), batch_size)
+    # a few blockbusters and a long tail
+    popularity = [rng.paretovariate(2) for _ in movies]
+    popularity = [value * len(popularity) / sum(popularity) for value in popularity]
+    username_prefix = 'synthetic{}-'.format(cinema.pk)
+    users = _create_reference(
+        User, (User(username=username_prefix + str(number), password='!') for number in range(users_count)),
+        User.objects.filter(username__startswith=username_prefix), batch_size)
+    user_pks = [user.pk for user in users]
+
+    _insert(TheaterRoom.objects, (
+        TheaterRoom(cinema=cinema, name='Room {}'.format(number + 1), rows_count=rng.randint(*ROWS_RANGE),
+                    seats_per_row_count=rng.randint(*SEATS_PER_ROW_RANGE)) for number in range(rooms_count)),
+        batch_size)
+    rooms = list(TheaterRoom.objects.filter(cinema=cinema).order_by('pk'))
+    _insert(Seat.objects, (
+        Seat(room=room, row=row, number=number) for room in rooms
+        for row in range(1, room.rows_count + 1) for number in range(1, room.seats_per_row_count + 1)),
+        batch_size)
+    seats = {room.pk: [] for room in rooms}
+    for room_pk, seat_pk in Seat.objects.filter(room__in=rooms).order_by('pk').values_list('room_id', 'pk') \
+            .iterator(chunk_size=batch_size):
+        seats[room_pk].append(seat_pk)
+
+    _insert(Screening.objects, _screenings(rng, rooms, movies, popularity, first_day, days), batch_size)
+    screenings = Screening.objects.filter(room__in=rooms).order_by('pk')
+    counts = {'movies': len(movies), 'users': len(users), 'rooms': len(rooms),
+              'seats': sum(len(room_seats) for room_seats in seats.values()), 'screenings': screenings.count(),
+              'reservations': 0}
+
+    movie_popularity = {movie.pk: value for movie, value in zip(movies, popularity)}
+    batch = []
+    for screening in screenings.iterator(chunk_size=batch_size):
+        share = fill * movie_popularity[screening.movie_id] * _demand(screening.start_time) * rng.uniform(.8, 1.2)
+        room_seats = seats[screening.room_id]
+        for seat_pk in rng.sample(room_seats, min(len(room_seats), round(share * len(room_seats)))):
+            batch.append(_reservation(rng, screening, seat_pk, rng.choice(user_pks)))
+        if len(batch) >= batch_size:
+            _insert(Reservation.objects, batch, batch_size)
+            counts['reservations'] += len(batch)
+            batch = []
+    _insert(Reservation.objects, batch, batch_size)
+    counts['reservations'] += len(batch)
+
+    stats.reconcile()
+    for offset in range(days):
+        programme.invalidate(first_day + timedelta(days=offset))
+    for model in (Movie, TheaterRoom, Screening):
+        compression.invalidate(model)
+    return counts
+
+
+def _create_reference(model, objects, created, batch_size):
+    """ Bulk creates reference rows on the default database and copies them to the other shards.
+    bulk_create does not set the primary keys on every database, so the rows are read back with ``created`` """
+    _insert(model.objects, objects, batch_size)
+    rows = list(created.using(DEFAULT_DB_ALIAS).order_by('pk'))
+    for alias in settings.CINEMA_SHARDS:
+        if alias != DEFAULT_DB_ALIAS:
+            _insert(model.objects.using(alias), rows, batch_size)
+    return rows
+
+
+def _insert(queryset, objects, batch_size):
+    """ bulk_create of batch_size rows at a time, consuming the objects lazily so generators are never held in
+    memory. Django 2.2 does not lower an explicit batch size to the limit of the database, which sqlite would
+    exceed """
+    objects = iter(objects)
+    fields = queryset.model._meta.concrete_fields
+    for batch in iter(lambda: list(islice(objects, batch_size)), []):
+        limit = connections[queryset.db].ops.bulk_batch_size(fields, batch)
+        queryset.bulk_create(batch, batch_size=min(batch_size, limit))
+
+
+def _screenings(rng, rooms, movies, popularity, first_day, days):
+    """ Back to back screenings of each room and day, the first one starting shortly after 8am """
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        for room in rooms:
+            minutes = FIRST_START_MIN + rng.randrange(0, 30, START_STEP_MIN)
+            while minutes <= LAST_START_MIN:
+                movie = rng.choices(movies, weights=popularity)[0]
+                yield Screening(room=room, movie=movie, price=rng.choice(PRICES), start_time=timezone.make_aware(
+                    datetime.combine(day, time(minutes // 60, minutes % 60))))
+                # the next screening starts at the first round time after the cleaning
+                minutes += movie.duration_minutes + Screening.IDLE_TIME
+                minutes += -minutes % START_STEP_MIN
+
+
+def _demand(start_time):
+    start_time = timezone.localtime(start_time)
+    demand = HOUR_DEMAND[start_time.hour]
+    if start_time.weekday() >= 5:
+        demand *= WEEKEND_DEMAND
+    return demand
+
+
+def _reservation(rng, screening, seat_pk, user_pk):
+    """ Reservation made in the booking window before the screening, purchased within a quarter of an hour or never """
+    reservation_time = screening.start_time - timedelta(minutes=rng.randint(10, BOOKING_WINDOW_MIN))
+    reservation = Reservation(screening_id=screening.pk, seat_id=seat_pk, user_id=user_pk,
+                              reservation_time=reservation_time)
+    if rng.random() < PURCHASED_SHARE:
+        reservation.purchase_time = reservation_time + timedelta(minutes=rng.randint(0, 15))
+        reservation.price_paid = screening.price
+    return reservation
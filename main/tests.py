@@ -1,14 +1,31 @@
-from datetime import timedelta
-
-from django.contrib.auth.models import User
+import gzip
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from io import StringIO
+from unittest import skipUnless, mock
+
+from django.contrib.auth.models import User, Group, Permission
+from django.core.cache import cache, caches
+from django.conf import settings
+from django.core.management import call_command
 from django.db.models import Max
+from django.test import override_settings
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.generics import get_object_or_404
-from rest_framework.test import APITestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction, OperationalError
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from main.models import Movie, Screening, TheaterRoom, Seat
+from main import checks, stats, archive, sharding, reference_cache, checkout, compression, degradation, programme, \
+    schedules
+from main.payments import StubPaymentProvider, PaymentUnavailable
+from main.models import Movie, Screening, ScreeningSchedule, Checkout, TheaterRoom, Seat, Reservation, MovieStats, \
+    DailyStats, ScreeningStats, ArchivedScreening, ArchivedReservation, Cinema, ChangeLogEntry
+from main.seat_map import SeatMap
 
 USERNAME = 'user'
 USER_EMAIL = 'user@example.com'
@@ -150,7 +167,7 @@ class AccountsTest(APITestCase):
         self.client.force_login(self.admin)
         response = self.client.get(self.get_list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
     def test_admin_gets_user_detail(self):
         self.client.force_login(self.admin)
@@ -240,6 +257,76 @@ class AccountsTest(APITestCase):
         self.assertEqual(response.data['username'], data['username'])
 
 
+class UserDirectoryTest(APITestCase):
+    fixtures = ['user.json', 'admin.json']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        self.url = reverse('accounts-list')
+        joined = timezone.make_aware(timezone.datetime(2020, 3, 1, 12, 0))
+        User.objects.bulk_create(User(username='member{:02}'.format(i), email='m{:02}@example.org'.format(i),
+                                      date_joined=joined + timedelta(days=i)) for i in range(30))
+
+    def _usernames(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [user['username'] for user in response.data['results']]
+
+    def test_cursor_pages(self):
+        response = self.client.get(self.url, {'page_size': 20})
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertIsNone(response.data['previous'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertIsNone(response.data['next'])
+
+    def test_search_by_prefix(self):
+        self.assertEqual(self._usernames(search='MEMBER2'), ['member{}'.format(i) for i in range(29, 19, -1)])
+        self.assertEqual(self._usernames(search='m05@'), ['member05'])
+        self.assertEqual(self._usernames(search='ember'), [])
+
+    def test_filter_by_join_date_and_staff(self):
+        self.assertEqual(self._usernames(joined_from='2020-03-02', joined_until='2020-03-03'), ['member02', 'member01'])
+        self.assertEqual(self._usernames(is_staff='true'), [ADMIN_USERNAME])
+
+    def test_invalid_filter(self):
+        response = self.client.get(self.url, {'joined_from': 'March'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_pages_through_tied_join_dates(self):
+        joined = timezone.make_aware(timezone.datetime(2020, 4, 1, 9, 0))
+        User.objects.bulk_create(User(username='imported{:04}'.format(i), date_joined=joined) for i in range(1200))
+        usernames = []
+        response = self.client.get(self.url, {'page_size': 500})
+        for _ in range(10):
+            usernames += [user['username'] for user in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(usernames), User.objects.count())
+        self.assertEqual(len(set(usernames)), len(usernames))
+
+        previous = self.client.get(self.client.get(self.url, {'page_size': 500}).data['next']).data['previous']
+        self.assertEqual(self.client.get(previous).data['results'][-1]['username'], usernames[499])
+
+    def test_cursor_bounds_the_join_date(self):
+        next_url = self.client.get(self.url, {'page_size': 10}).data['next']
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(next_url)
+        sql = next(query['sql'] for query in context.captured_queries if 'LIMIT 11' in query['sql'])
+        self.assertIn('"auth_user"."date_joined" <= ', sql)
+        previous_url = self.client.get(next_url).data['previous']
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(previous_url)
+        sql = next(query['sql'] for query in context.captured_queries if 'LIMIT 11' in query['sql'])
+        self.assertIn('"auth_user"."date_joined" >= ', sql)
+
+    def test_invalid_cursor(self):
+        # position 'x'
+        response = self.client.get(self.url, {'cursor': 'cD14'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class TheaterRoomTest(APITestCase):
     def setUp(self):
         self.list_url = reverse('theater-room-list')
@@ -569,6 +656,200 @@ class ScreeningTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class SparseFieldsetsTest(APITestCase):
+    fixtures = ['movies.json', 'screenings.json']
+
+    def _get(self, url, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, context.captured_queries[-1]['sql']
+
+    def test_screening_fields(self):
+        data, sql = self._get(reverse('screenings-list'), fields='id,start_time,movie')
+        self.assertEqual([set(screening) for screening in data], [{'id', 'start_time', 'movie'}] * 2)
+        self.assertNotIn('"price"', sql)
+        self.assertNotIn('JOIN', sql)
+
+    def test_screening_omit(self):
+        data, sql = self._get(reverse('screenings-list'), omit='available_seats,price')
+        self.assertEqual(set(data[0]), {'id', 'cinema', 'room', 'movie', 'start_time'})
+        self.assertIn('"cinema_id"', sql)
+
+    def test_movie_and_room_fields(self):
+        data, sql = self._get(reverse('movies-list'), fields='title')
+        self.assertEqual(data[0], {'title': "Harry Potter and the Philosopher's Stone"})
+        self.assertNotIn('"duration_minutes"', sql)
+        data, sql = self._get(reverse('theater-room-list'), omit='rows_count,seats_per_row_count,unknown')
+        self.assertEqual(set(data[0]), {'id', 'cinema', 'name'})
+
+    def test_detail_fields(self):
+        data, sql = self._get(reverse('screenings-detail', kwargs={'pk': 1}), fields='price')
+        self.assertEqual(data, {'price': 100})
+
+
+class BulkPriceTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('screenings-bulk-price')
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+
+    def test_set_price_by_movie(self):
+        response = self.client.post(self.url, {'movie': 2, 'price': 120})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'updated': 1, 'days': 1, 'schedules': 0})
+        self.assertEqual(list(Screening.objects.order_by('pk').values_list('price', flat=True)), [100, 120])
+
+    def test_change_price_by_percent(self):
+        response = self.client.post(self.url, {'first_day': '2020-07-17', 'last_day': '2020-07-17', 'percent': -15})
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(list(Screening.objects.order_by('pk').values_list('price', flat=True)), [85, 128])
+
+    def test_runs_set_based(self):
+        with self.assertNumQueries(10):
+            self.client.post(self.url, {'room': 1, 'percent': 10})
+
+    def _schedule(self, first_day, last_day, materialized_until=None):
+        return ScreeningSchedule.objects.create(room_id=1, movie_id=2, price=100, first_day=first_day,
+                                                last_day=last_day, times='10:00', materialized_until=materialized_until)
+
+    def test_changes_price_of_schedules_not_materialized_yet(self):
+        schedule = self._schedule(date(2020, 8, 1), date(2020, 8, 20), materialized_until=date(2020, 8, 5))
+        materialized = self._schedule(date(2020, 8, 1), date(2020, 8, 5), materialized_until=date(2020, 8, 5))
+        response = self.client.post(self.url, {'movie': 2, 'first_day': '2020-08-06', 'percent': -20})
+        self.assertEqual(response.data, {'updated': 0, 'days': 0, 'schedules': 1})
+        self.assertEqual(ScreeningSchedule.objects.get(pk=schedule.pk).price, 80)
+        self.assertEqual(ScreeningSchedule.objects.get(pk=materialized.pk).price, 100)
+
+    def test_part_of_pending_schedule_is_rejected(self):
+        schedule = self._schedule(date(2020, 8, 1), date(2020, 8, 20), materialized_until=date(2020, 8, 5))
+        response = self.client.post(self.url, {'movie': 2, 'last_day': '2020-08-10', 'price': 50})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ScreeningSchedule.objects.get(pk=schedule.pk).price, 100)
+        self.assertEqual(Screening.objects.get(pk=2).price, 150)
+
+    def test_invalid_requests(self):
+        for data in ({'price': 10}, {'room': 1}, {'room': 1, 'price': 10, 'percent': 5}, {'room': 1, 'percent': -100}):
+            response = self.client.post(self.url, data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_cannot_change_prices(self):
+        self.client.force_login(User.objects.get(username=USERNAME))
+        response = self.client.post(self.url, {'room': 1, 'price': 10})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ReferenceCacheTest(APITransactionTestCase):
+    # outside of a test transaction, reads inside a transaction bypass the cache
+    serialized_rollback = True
+    fixtures = ['admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        reference_cache.clear()
+
+    def _create_screening(self, hour):
+        data = {'room': 1, 'movie': 2, 'start_time': timezone.datetime(2020, 7, 18, hour, 0, 0), 'price': 10}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('screenings-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return [q['sql'] for q in context.captured_queries
+                if 'FROM "main_movie" WHERE' in q['sql'] or 'FROM "main_theaterroom" WHERE' in q['sql']]
+
+    def test_validation_reads_reference_rows_once(self):
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        self.assertTrue(self._create_screening(9))
+        self.assertEqual(self._create_screening(13), [])
+
+    def test_save_invalidates(self):
+        movie = reference_cache.get(Movie, 1)
+        movie.duration_minutes = 100
+        movie.save()
+        self.assertEqual(reference_cache.get(Movie, '1').duration_minutes, 100)
+
+    @override_settings(REFERENCE_CACHE_CHECK_SECONDS=0)
+    def test_change_in_other_process_invalidates(self):
+        reference_cache.get(Movie, 1)
+        Movie.objects.filter(pk=1).update(title='Changed')
+        self.assertNotEqual(reference_cache.get(Movie, 1).title, 'Changed')
+        # saving the movie in another process bumps the version through its own cache client
+        other_process = threading.Thread(target=lambda: caches['default'].set('reference-cache:main.Movie', 1))
+        other_process.start()
+        other_process.join()
+        self.assertEqual(reference_cache.get(Movie, 1).title, 'Changed')
+
+    def test_process_local_cache_is_reported(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([message.id for message in checks.check_shared_cache(None)], ['main.W001'])
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': 'memcached:11211'}}):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+    @override_settings(REFERENCE_CACHE_SIZE=1)
+    def test_size_bounded(self):
+        reference_cache.get(Movie, 1)
+        reference_cache.get(Movie, 2)
+        with self.assertNumQueries(1):
+            reference_cache.get(Movie, 1)
+
+    def test_unknown_room(self):
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        data = {'room': 999, 'movie': 2, 'start_time': timezone.datetime(2020, 7, 18, 9, 0, 0), 'price': 10}
+        response = self.client.post(reverse('screenings-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('room', response.data)
+
+
+class PrecompressedListTest(APITransactionTestCase):
+    # outside of a test transaction, lists rendered inside a transaction are not cached
+    serialized_rollback = True
+    fixtures = ['admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('movies-list')
+
+    def test_compressed_once_per_change(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 2)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        Movie.objects.create(title='New', duration_minutes=100)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 3)
+
+    def test_identity_without_accept_encoding(self):
+        for accept_encoding in ('', 'gzip;q=0', 'identity'):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(len(response.json()), 2)
+
+    def test_screenings_invalidated_by_bulk_update(self):
+        url = reverse('screenings-list')
+        self.client.get(url)
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        self.client.post(reverse('screenings-bulk-price'), {'movie': 1, 'price': 42})
+        self.assertEqual(self.client.get(url).json()[0]['price'], 42)
+
+    @override_settings(ALLOWED_HOSTS=['internal.local', 'public.example.com'])
+    def test_cached_per_host(self):
+        url = reverse('screenings-list')
+        self.client.get(url, HTTP_HOST='internal.local')
+        response = self.client.get(url, HTTP_HOST='public.example.com', secure=True)
+        self.assertTrue(response.json()[0]['available_seats'].startswith('https://public.example.com/'))
+
+    def test_choose_encoding(self):
+        self.assertEqual(compression.choose_encoding('br;q=1.0, gzip;q=0.8', {'identity', 'gzip', 'br'}), 'br')
+        self.assertEqual(compression.choose_encoding('br', {'identity', 'gzip'}), 'identity')
+        self.assertEqual(compression.choose_encoding('*', {'identity', 'gzip'}), 'gzip')
+
+
 class SeatTest(APITestCase):
     def test_seats_are_correct_count(self):
         """ test makes sure the count of seats is correct for each Theater Room.
@@ -578,3 +859,1029 @@ class SeatTest(APITestCase):
             self.assertEqual(room_seats.count(), room.rows_count * room.seats_per_row_count)
             self.assertEqual(room_seats.aggregate(Max('row'))['row__max'], room.rows_count)
             self.assertEqual(room_seats.aggregate(Max('number'))['number__max'], room.seats_per_row_count)
+
+
+class ReservationTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.get(username=USERNAME)
+        self.screening = Screening.objects.get(pk=1)
+        self.seat = Seat.objects.filter(room=self.screening.room).first()
+
+        self.list_url = reverse('reservations-list')
+        self.client.force_login(self.user)
+
+    def _reserve(self, seat, **extra):
+        return self.client.post(self.list_url, {'screening': self.screening.pk, 'seat': seat.pk}, **extra)
+
+    def test_create_reservation(self):
+        response = self._reserve(self.seat)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.data['purchase_time'])
+        self.assertEqual(Reservation.objects.get(pk=response.data['id']).user, self.user)
+
+    def test_create_reservation_anon(self):
+        self.client.logout()
+        response = self._reserve(self.seat)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_create_reservation_seat_taken(self):
+        self._reserve(self.seat)
+        response = self._reserve(self.seat)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['non_field_errors'][0], 'The seat is already reserved for this screening.')
+
+    def test_create_reservation_seat_in_other_room(self):
+        seat = Seat.objects.exclude(room=self.screening.room).first()
+        response = self._reserve(seat)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['seat'][0], 'The seat is not in the screening room.')
+
+    def test_purchase_reservation(self):
+        reservation_id = self._reserve(self.seat).data['id']
+        url = reverse('reservations-purchase', kwargs={'pk': reservation_id})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['price_paid'], self.screening.price)
+        self.assertIsNotNone(response.data['purchase_time'])
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], 'The reservation is already purchased.')
+
+    def test_retry_with_idempotency_key_replays_response(self):
+        first = self._reserve(self.seat, HTTP_IDEMPOTENCY_KEY='abc')
+        retry = self._reserve(self.seat, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_reuse_idempotency_key_with_other_request(self):
+        self._reserve(self.seat, HTTP_IDEMPOTENCY_KEY='abc')
+        other_seat = Seat.objects.filter(room=self.screening.room).exclude(pk=self.seat.pk).first()
+        response = self._reserve(other_seat, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+
+class UnavailableOncePaymentProvider(StubPaymentProvider):
+    calls = 0
+
+    def charge(self, reference, amount):
+        UnavailableOncePaymentProvider.calls += 1
+        if UnavailableOncePaymentProvider.calls == 1:
+            raise PaymentUnavailable('The payment provider is unavailable.')
+        return super().charge(reference, amount)
+
+
+@override_settings(CHECKOUT=dict(settings.CHECKOUT, STUB_LATENCY_SECONDS=0, WORKERS=2))
+class CheckoutTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.get(username=USERNAME)
+        self.screening = Screening.objects.get(pk=1)
+        self.reservation = Reservation.objects.create(
+            screening=self.screening, user=self.user, reservation_time=timezone.now(),
+            seat=Seat.objects.filter(room=self.screening.room).first())
+        self.url = reverse('reservations-checkout', kwargs={'pk': self.reservation.pk})
+        self.client.force_login(self.user)
+
+    def _process(self):
+        call_command('process_checkouts', once=True, stdout=StringIO())
+
+    def test_checkout_is_accepted_and_queued(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], Checkout.PENDING)
+        self.assertEqual(response['Location'], response.data['url'])
+        self.assertFalse(Reservation.objects.get(pk=self.reservation.pk).is_purchased)
+        self.assertEqual(self.client.post(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_worker_completes_purchase(self):
+        status_url = self.client.post(self.url)['Location']
+        self._process()
+        data = self.client.get(status_url).data
+        self.assertEqual(data['status'], Checkout.COMPLETED)
+        self.assertEqual(checkout.read_ticket(data['ticket'])['reservation'], self.reservation.pk)
+        reservation = Reservation.objects.get(pk=self.reservation.pk)
+        self.assertEqual(reservation.price_paid, self.screening.price)
+        self.assertEqual(ScreeningStats.objects.get(screening=self.screening).sold_count, 1)
+        self.assertEqual(self.client.post(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(CHECKOUT=dict(settings.CHECKOUT, STUB_LATENCY_SECONDS=0,
+                                     PAYMENT_PROVIDER='main.tests.UnavailableOncePaymentProvider'))
+    def test_unavailable_payment_is_retried(self):
+        UnavailableOncePaymentProvider.calls = 0
+        self.client.post(self.url)
+        self._process()
+        order = Checkout.objects.get()
+        self.assertEqual((order.status, order.attempts), (Checkout.PENDING, 1))
+        self.assertGreater(order.next_attempt_at, timezone.now())
+        Checkout.objects.update(next_attempt_at=timezone.now())
+        self._process()
+        self.assertEqual(Checkout.objects.get().status, Checkout.COMPLETED)
+
+    def test_already_purchased_is_refunded(self):
+        self.client.post(self.url)
+        self.client.post(reverse('reservations-purchase', kwargs={'pk': self.reservation.pk}))
+        refunded = []
+        with mock.patch.object(StubPaymentProvider, 'refund', lambda provider, payment_id: refunded.append(
+                (payment_id, Checkout.objects.get().status))):
+            self._process()
+        order = Checkout.objects.get()
+        self.assertEqual(order.status, Checkout.FAILED)
+        # refunded once the batch is written
+        self.assertEqual(refunded, [(order.payment_id, Checkout.FAILED)])
+
+    def test_archive_waits_for_pending_checkout(self):
+        self.client.post(self.url)
+        self.assertEqual(archive.archive(timezone.datetime(2100, 1, 1, tzinfo=timezone.utc)), (1, 0))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(checkout.process_batch(executor), 1)
+        self.assertEqual(Checkout.objects.get().status, Checkout.COMPLETED)
+        self.assertEqual(archive.archive(timezone.datetime(2100, 1, 1, tzinfo=timezone.utc)), (1, 1))
+
+    def test_checkout_of_deleted_reservation_fails(self):
+        self.client.post(self.url)
+        Reservation.objects.filter(pk=self.reservation.pk).delete()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(checkout.process_batch(executor), 1)
+        order = Checkout.objects.get()
+        self.assertEqual((order.status, order.attempts, order.error),
+                         (Checkout.FAILED, 1, 'The reservation no longer exists.'))
+
+    def test_metrics(self):
+        self.client.post(self.url)
+        self._process()
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        response = self.client.get(reverse('checkouts-metrics'))
+        self.assertEqual(response.data['completed'], 1)
+        self.assertEqual(response.data['pending'], 0)
+        self.assertIsNotNone(response.data['average_seconds_to_complete'])
+
+    def test_checkout_of_other_user_is_hidden(self):
+        status_url = self.client.post(self.url)['Location']
+        other = User.objects.create_user('other', 'other@example.com', 'otherother')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status_url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(WAITING_ROOM={'ENABLED': True, 'MAX_ACTIVE_SESSIONS': 1, 'ADMIT_RATE': 10 ** 6, 'SESSION_TTL': 60})
+class WaitingRoomTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.get(username=ADMIN_USERNAME)
+        self.user = User.objects.get(username=USERNAME)
+        self.screening = Screening.objects.get(pk=1)
+
+        self.join_url = reverse('waiting-room-join', kwargs={'pk': self.screening.pk})
+        self.seats_url = reverse('available-seats', kwargs={'pk': self.screening.pk})
+
+    def _join(self, user):
+        self.client.force_login(user)
+        return self.client.post(self.join_url).data
+
+    def test_first_visitor_is_admitted(self):
+        ticket = self._join(self.user)
+        self.assertEqual(ticket['status'], 'admitted')
+        response = self.client.get(self.seats_url, HTTP_X_WAITING_ROOM_TOKEN=ticket['token'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_request_without_token_is_rejected(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.seats_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_visitors_over_capacity_wait_until_slot_is_freed(self):
+        first = self._join(self.user)
+        second = self._join(self.admin)
+        self.assertEqual(second['status'], 'waiting')
+        self.assertEqual(second['position'], 1)
+        response = self.client.get(self.seats_url, HTTP_X_WAITING_ROOM_TOKEN=second['token'])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.delete(reverse('waiting-room-ticket', kwargs={'token': first['token']}))
+        response = self.client.get(reverse('waiting-room-ticket', kwargs={'token': second['token']}))
+        self.assertEqual(response.data['status'], 'admitted')
+
+    def test_token_of_other_user_is_rejected(self):
+        ticket = self._join(self.user)
+        self.client.force_login(self.admin)
+        response = self.client.get(self.seats_url, HTTP_X_WAITING_ROOM_TOKEN=ticket['token'])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_process_local_cache_fails_checks(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([message.id for message in checks.check_waiting_room_cache(None)], ['main.E001'])
+
+
+class AvailableSeatsTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username=USERNAME)
+        self.screening = Screening.objects.get(pk=1)
+        self.room = self.screening.room
+        self.reserved_seat = Seat.objects.get(room=self.room, row=2, number=3)
+        Reservation.objects.create(screening=self.screening, seat=self.reserved_seat, user=self.user,
+                                   reservation_time=timezone.now())
+
+        self.url = reverse('available-seats', kwargs={'pk': self.screening.pk})
+        self.client.force_login(self.user)
+
+    def test_list_available_seat_ids(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), self.room.rows_count * self.room.seats_per_row_count - 1)
+        self.assertNotIn(self.reserved_seat.pk, response.data)
+
+    def test_run_length_seat_map(self):
+        response = self.client.get(self.url, {'format': 'rle'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content.decode(), '10x15:17A1R132A')
+
+    def test_bitmap_seat_map(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/vnd.cinema.seatmap-bitmap')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        seat_map = SeatMap.from_bitmap(response.content.decode())
+        self.assertFalse(seat_map.is_available(2, 3))
+        self.assertEqual(sum(seat_map.available), self.room.rows_count * self.room.seats_per_row_count - 1)
+
+    def test_seat_map_unknown_screening(self):
+        response = self.client.get(reverse('available-seats', kwargs={'pk': 100}), {'format': 'rle'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SeatCategoriesTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        reference_cache.clear()
+        self.screening = Screening.objects.select_related('room').get(pk=1)
+        self.url = reverse('theater-room-seat-categories', kwargs={'pk': self.screening.room_id})
+        self.seats_url = reverse('available-seats', kwargs={'pk': self.screening.pk})
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        self.categories = {'vip': [[5, 7], [5, 8]], 'accessible': [[1, 1], [5, 8]], 'blocked': [[1, 2]]}
+        self.client.put(self.url, self.categories, format='json')
+
+    def _seat(self, row, number):
+        return Seat.objects.get(room=self.screening.room, row=row, number=number)
+
+    def test_categories_stored_per_room(self):
+        self.assertEqual(self.client.get(self.url).data, self.categories)
+        self.assertEqual(len(TheaterRoom.objects.get(pk=self.screening.room_id).seat_categories), 150)
+
+    def test_available_seats_of_category(self):
+        response = self.client.get(self.seats_url, {'category': 'accessible'})
+        self.assertEqual(sorted(response.data), sorted([self._seat(1, 1).pk, self._seat(5, 8).pk]))
+        response = self.client.get(self.seats_url, {'category': 'vip,accessible'})
+        self.assertEqual(response.data, [self._seat(5, 8).pk])
+        response = self.client.get(self.seats_url, {'category': 'vip', 'format': 'rle'})
+        self.assertEqual(response.content.decode(), '10x15:66R2A82R')
+
+    def test_blocked_seat_is_never_available(self):
+        response = self.client.get(self.seats_url)
+        self.assertEqual(len(response.data), 149)
+        self.assertNotIn(self._seat(1, 2).pk, response.data)
+        response = self.client.post(reverse('reservations-list'),
+                                    {'screening': self.screening.pk, 'seat': self._seat(1, 2).pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_categories(self):
+        response = self.client.get(self.seats_url, {'category': 'balcony'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(self.url, {'vip': [[11, 1]]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_cannot_change_categories(self):
+        self.client.force_login(User.objects.get(username=USERNAME))
+        response = self.client.put(self.url, {'vip': [[1, 1]]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_blocked_seats_are_not_capacity(self):
+        self.assertEqual(ScreeningStats.objects.get(screening=self.screening).capacity, 149)
+        # both screenings of the day are in the room
+        self.assertEqual(DailyStats.objects.get(date=self.screening.day).capacity, 2 * 149)
+        programme = self.client.get(reverse('programme', kwargs={'date': self.screening.day})).json()
+        self.assertEqual(programme['screenings'][0]['seats_left'], 149)
+        stats.reconcile()
+        self.assertEqual(ScreeningStats.objects.get(screening=self.screening).capacity, 149)
+
+        self.client.put(self.url, {'blocked': [[1, 2], [1, 3]]}, format='json')
+        self.assertEqual(ScreeningStats.objects.get(screening=self.screening).capacity, 148)
+        programme = self.client.get(reverse('programme', kwargs={'date': self.screening.day})).json()
+        self.assertEqual(programme['screenings'][0]['seats_left'], 148)
+
+    def test_capacity_change_refreshes_each_aggregate_once(self):
+        room = self.screening.room
+        room.blocked_seats_count = 2
+        room.save(update_fields=['blocked_seats_count'])
+        with CaptureQueriesContext(connection) as context:
+            stats.capacity_changed(room)
+        for hour in (9, 20, 22):
+            start_time = self.screening.start_time.replace(hour=hour)
+            stats.screening_created(Screening.objects.create(room=room, movie=self.screening.movie, price=100,
+                                                             start_time=start_time))
+        with self.assertNumQueries(len(context.captured_queries)):
+            stats.capacity_changed(room)
+        self.assertEqual(set(ScreeningStats.objects.filter(screening__room=room).values_list('capacity', flat=True)),
+                         {148})
+        self.assertEqual(DailyStats.objects.get(date=self.screening.day).capacity, 5 * 148)
+
+
+class BestSeatsTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username=USERNAME)
+        self.screening = Screening.objects.get(pk=1)
+        self.url = reverse('best-seats', kwargs={'pk': self.screening.pk})
+        self.client.force_login(self.user)
+
+    def _reserve(self, row, numbers):
+        for number in numbers:
+            Reservation.objects.create(screening=self.screening, user=self.user, reservation_time=timezone.now(),
+                                       seat=Seat.objects.get(room=self.screening.room, row=row, number=number))
+
+    def test_best_seats_in_empty_room_are_central(self):
+        # the room has 10 rows of 15 seats
+        response = self.client.get(self.url, {'count': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(response.data['row'], (5, 6))
+        self.assertEqual(response.data['numbers'], [7, 8, 9])
+        self.assertEqual(len(response.data['seats']), 3)
+
+    def test_best_seats_skip_reserved(self):
+        self._reserve(5, [8])
+        self._reserve(6, [8])
+        response = self.client.get(self.url, {'count': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # moving one row away from the center beats moving the block off center in the central rows
+        self.assertIn(response.data['row'], (4, 7))
+        self.assertEqual(response.data['numbers'], [7, 8, 9])
+
+    def test_best_seats_count_too_large(self):
+        response = self.client.get(self.url, {'count': 16})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_best_seats_of_category(self):
+        room = self.screening.room
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        self.client.put(reverse('theater-room-seat-categories', kwargs={'pk': room.pk}),
+                        {'accessible': [[10, 1], [10, 2], [10, 3], [10, 14], [10, 15]]}, format='json')
+        self._reserve(10, [14])
+        response = self.client.get(self.url, {'count': 2, 'category': 'accessible'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['row'], response.data['numbers']), (10, [2, 3]))
+        response = self.client.get(self.url, {'count': 4, 'category': 'accessible'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_seat_map_best_block_none_when_full(self):
+        seat_map = SeatMap(2, 4, bytearray([1, 0, 1, 1, 0, 1, 0, 1]))
+        self.assertEqual(seat_map.best_block(2), (1, 3))
+        self.assertIsNone(seat_map.best_block(3))
+
+
+class StatsTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.get(username=ADMIN_USERNAME)
+        self.user = User.objects.get(username=USERNAME)
+        self.screening = Screening.objects.get(pk=1)
+        self.seats = Seat.objects.filter(room=self.screening.room)[:3]
+
+    def _reserve_and_purchase(self, seat):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('reservations-list'), {'screening': self.screening.pk, 'seat': seat.pk})
+        self.client.post(reverse('reservations-purchase', kwargs={'pk': response.data['id']}))
+
+    def test_reservation_writes_update_stats(self):
+        self._reserve_and_purchase(self.seats[0])
+        self._reserve_and_purchase(self.seats[1])
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('screening-stats-detail', kwargs={'pk': self.screening.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['capacity'], 150)
+        self.assertEqual(response.data['reserved_count'], 2)
+        self.assertEqual(response.data['sold_count'], 2)
+        self.assertEqual(response.data['revenue'], 2 * self.screening.price)
+        self.assertEqual(response.data['occupancy'], 1.33)
+
+        day_stats = DailyStats.objects.get(date=self.screening.start_time.date())
+        # both screenings of the fixture are on the same day in the same room
+        self.assertEqual(day_stats.capacity, 300)
+        self.assertEqual(day_stats.revenue, 2 * self.screening.price)
+
+    def test_screening_created_adds_capacity(self):
+        self._reserve_and_purchase(self.seats[0])
+        self.client.force_login(self.admin)
+        data = {"room": 2, "movie": 1, "start_time": self.screening.start_time, "price": 200}
+        response = self.client.post(reverse('screenings-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(MovieStats.objects.get(movie_id=1).capacity, 150 + 600)
+
+    def test_reconcile_matches_incremental_stats(self):
+        self._reserve_and_purchase(self.seats[0])
+        self._reserve_and_purchase(self.seats[2])
+        incremental = MovieStats.objects.filter(movie_id=1).values().get()
+        stats.reconcile()
+        self.assertEqual(MovieStats.objects.filter(movie_id=1).values().get(), incremental)
+        # the other movie of the fixture has no reservations, so only the reconcile creates its row
+        self.assertEqual(MovieStats.objects.get(movie_id=2).capacity, 150)
+
+    def test_stats_admin_only(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('daily-stats-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ExportTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        self.admin = User.objects.get(username=ADMIN_USERNAME)
+        self.user = User.objects.get(username=USERNAME)
+        self.screening = Screening.objects.get(pk=1)
+        for seat in Seat.objects.filter(room=self.screening.room)[:2]:
+            Reservation.objects.create(screening=self.screening, seat=seat, user=self.user,
+                                       reservation_time=self.screening.start_time - timedelta(days=1))
+        self.url = reverse('export', kwargs={'name': 'reservations'})
+
+    def test_export_reservations_csv(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('id,screening_id,'))
+
+    def test_export_screenings_jsonl_by_month(self):
+        self.client.force_login(self.admin)
+        url = reverse('export', kwargs={'name': 'screenings'})
+        response = self.client.get(url, {'format': 'jsonl', 'month': '2020-07'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [1, 2])
+
+        response = self.client.get(url, {'format': 'jsonl', 'month': '2020-08'})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_export_invalid_month(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(self.url, {'month': 'July'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_user(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export', 'reservations', '--format', 'jsonl', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+    def test_export_archived_month(self):
+        self.client.force_login(self.admin)
+        archive.archive(timezone.datetime(2020, 8, 1, tzinfo=timezone.utc))
+        response = self.client.get(self.url, {'format': 'jsonl', 'month': '2020-07'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['screening__movie__title'], self.screening.movie.title)
+        response = self.client.get(reverse('export', kwargs={'name': 'screenings'}), {'format': 'jsonl'})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 2)
+
+    def test_export_archived_rows_of_deleted_movie_and_room(self):
+        self.client.force_login(self.admin)
+        archive.archive(timezone.datetime(2020, 8, 1, tzinfo=timezone.utc))
+        title, room_name = self.screening.movie.title, self.screening.room.name
+        Movie.objects.filter(pk=self.screening.movie_id).delete()
+        Seat.objects.filter(room_id=self.screening.room_id).delete()
+        TheaterRoom.objects.filter(pk=self.screening.room_id).delete()
+        response = self.client.get(self.url, {'format': 'jsonl'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual((rows[0]['screening__movie__title'], rows[0]['screening__room__name']), (title, room_name))
+        self.assertIsNotNone(rows[0]['seat__row'])
+        response = self.client.get(reverse('export', kwargs={'name': 'screenings'}), {'format': 'jsonl'})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 2)
+
+
+class ArchiveTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username=USERNAME)
+        self.screening = Screening.objects.get(pk=1)
+        for seat in Seat.objects.filter(room=self.screening.room)[:3]:
+            Reservation.objects.create(screening=self.screening, seat=seat, user=self.user,
+                                       reservation_time=self.screening.start_time, price_paid=100,
+                                       purchase_time=self.screening.start_time)
+        self.future_screening = Screening.objects.create(
+            room=self.screening.room, movie=self.screening.movie, price=100,
+            start_time=self.screening.start_time + timedelta(days=31))
+
+    def test_archive_moves_closed_months(self):
+        before = timezone.datetime(2020, 8, 1, tzinfo=timezone.utc)
+        self.assertEqual(archive.archive(before, batch_size=1), (2, 3))
+        self.assertEqual(list(Screening.objects.values_list('pk', flat=True)), [self.future_screening.pk])
+        self.assertEqual(Reservation.objects.count(), 0)
+        self.assertEqual(ArchivedScreening.objects.count(), 2)
+        self.assertEqual(ArchivedReservation.objects.filter(screening_id=self.screening.pk).count(), 3)
+
+    def test_reconcile_counts_archived_screenings(self):
+        archive.archive(timezone.datetime(2020, 8, 1, tzinfo=timezone.utc))
+        stats.reconcile()
+        movie_stats = MovieStats.objects.get(movie=self.screening.movie)
+        self.assertEqual(movie_stats.capacity, 2 * 150)
+        self.assertEqual(movie_stats.revenue, 300)
+        self.assertEqual(DailyStats.objects.get(date=self.screening.start_time.date()).sold_count, 3)
+
+    def test_archive_keeps_checkouts(self):
+        reservation = Reservation.objects.filter(screening=self.screening).first()
+        Checkout.objects.create(reservation=reservation, amount=100, status=Checkout.COMPLETED, payment_id='pay-1')
+        archive.archive(timezone.datetime(2020, 8, 1, tzinfo=timezone.utc))
+        self.assertEqual(Checkout.objects.get().payment_id, 'pay-1')
+        self.assertTrue(ArchivedReservation.objects.filter(pk=Checkout.objects.get().reservation_id).exists())
+
+    def test_default_cutoff(self):
+        now = timezone.datetime(2020, 2, 15, tzinfo=timezone.utc)
+        with override_settings(ARCHIVE_AFTER_MONTHS=3):
+            self.assertEqual(archive.default_cutoff(now), timezone.datetime(2019, 11, 1, tzinfo=timezone.utc))
+
+
+class SyntheticDataTest(APITestCase):
+    def _generate(self, seed=1):
+        call_command('generate_data', first_day='2030-06-07', days=2, rooms=2, movies=3, users=5, seed=seed,
+                     batch_size=50, stdout=StringIO())
+        cinema = Cinema.objects.latest('pk')
+        screenings = Screening.objects.filter(room__cinema=cinema).select_related('room', 'movie') \
+            .order_by('room__name', 'start_time')
+        return [(s.room.name, s.room.rows_count, s.start_time, s.movie.duration_minutes, s.price,
+                 s.reservation_set.count(), s.reservation_set.filter(purchase_time__isnull=False).count())
+                for s in screenings]
+
+    def test_screenings_follow_schedule_rules(self):
+        self._generate()
+        screenings = list(Screening.objects.filter(room__cinema=Cinema.objects.latest('pk'))
+                          .select_related('room', 'movie').order_by('room', 'start_time'))
+        self.assertTrue(screenings)
+        for previous, screening in zip(screenings, screenings[1:]):
+            if previous.room_id == screening.room_id:
+                self.assertLessEqual(previous.end_time, screening.start_time)
+        for screening in screenings:
+            start_time = timezone.localtime(screening.start_time).time()
+            self.assertTrue(timezone.datetime(1, 1, 1, 8).time() <= start_time <= timezone.datetime(1, 1, 1, 23).time())
+            self.assertEqual(screening.stats.reserved_count, screening.reservation_set.count())
+            self.assertEqual(screening.reservation_set.values('seat').distinct().count(),
+                             screening.reservation_set.count())
+        self.assertTrue(Reservation.objects.filter(screening__in=screenings).exists())
+
+    def test_same_seed_generates_same_data(self):
+        self.assertEqual(self._generate(), self._generate())
+        self.assertNotEqual(self._generate(), self._generate(seed=2))
+
+
+class ProgrammeTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.get(username=ADMIN_USERNAME)
+        self.user = User.objects.get(username=USERNAME)
+        self.screening = Screening.objects.get(pk=1)
+        self.url = reverse('programme', kwargs={'date': '2020-07-17'})
+
+    def test_programme_of_day(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        document = response.json()
+        self.assertEqual([s['id'] for s in document['screenings']], [1, 2])
+        self.assertEqual(document['screenings'][0]['movie']['title'], self.screening.movie.title)
+        self.assertEqual(document['screenings'][0]['seats_left'], 150)
+
+    def test_programme_is_served_from_snapshot(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_reservation_updates_seats_left(self):
+        self.client.get(self.url)
+        self.client.force_login(self.user)
+        seat = Seat.objects.filter(room=self.screening.room).first()
+        self.client.post(reverse('reservations-list'), {'screening': self.screening.pk, 'seat': seat.pk})
+        self.assertEqual(self.client.get(self.url).json()['screenings'][0]['seats_left'], 149)
+
+    def test_screening_change_rebuilds_affected_days(self):
+        self.client.get(self.url)
+        self.client.force_login(self.admin)
+        new_start = self.screening.start_time + timedelta(days=1)
+        data = {'room': 1, 'movie': 1, 'start_time': new_start}
+        self.client.patch(reverse('screenings-detail', kwargs={'pk': 1}), data)
+        self.assertEqual([s['id'] for s in self.client.get(self.url).json()['screenings']], [2])
+        response = self.client.get(reverse('programme', kwargs={'date': '2020-07-18'}))
+        self.assertEqual([s['id'] for s in response.json()['screenings']], [1])
+
+    def test_programme_invalid_date(self):
+        response = self.client.get(reverse('programme', kwargs={'date': 'today'}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProgrammeInvalidationTest(APITransactionTestCase):
+    # on commit callbacks only run outside of a test transaction
+    serialized_rollback = True
+    fixtures = ['user.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('programme', kwargs={'date': '2020-07-17'})
+
+    def test_reservation_commit_drops_document_read_before(self):
+        stale_document = self.client.get(self.url).content.decode()
+        self.client.force_login(User.objects.get(username=USERNAME))
+        screening = Screening.objects.get(pk=1)
+        with transaction.atomic():
+            self.client.post(reverse('reservations-list'),
+                             {'screening': screening.pk, 'seat': Seat.objects.filter(room=screening.room).first().pk})
+            # a read of another connection before the commit stores the document without the reservation
+            cache.set('programme:default:2020-07-17', stale_document)
+        self.assertEqual(self.client.get(self.url).json()['screenings'][0]['seats_left'], 149)
+
+
+class ScreeningScheduleTest(APITestCase):
+    fixtures = ['admin.json', 'movies.json']
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        self.first_day = timezone.localdate() + timedelta(days=1)
+        self.data = {'room': 1, 'movie': 1, 'price': 10, 'first_day': self.first_day,
+                     'last_day': self.first_day + timedelta(days=59), 'times': '10:00,18:00'}
+
+    def test_create_materializes_window(self):
+        response = self.client.post(reverse('screening-schedules-list'), self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Screening.objects.filter(schedule_id=response.data['id']).count(),
+                         2 * settings.SCHEDULE_WINDOW_DAYS)
+        window_end = timezone.localdate() + timedelta(days=settings.SCHEDULE_WINDOW_DAYS)
+        self.assertEqual(ScreeningSchedule.objects.get(pk=response.data['id']).materialized_until, window_end)
+
+    def test_materialize_command_extends_window(self):
+        self.client.post(reverse('screening-schedules-list'), self.data)
+        until = self.first_day + timedelta(days=29)
+        call_command('materialize_schedules', until=until.isoformat(), stdout=StringIO())
+        self.assertEqual(Screening.objects.filter(schedule__isnull=False).count(), 60)
+        call_command('materialize_schedules', until=until.isoformat(), stdout=StringIO())
+        self.assertEqual(Screening.objects.filter(schedule__isnull=False).count(), 60)
+        self.assertEqual(MovieStats.objects.get(movie_id=1).capacity, 60 * 150)
+
+    def test_materializing_twice_creates_screenings_once(self):
+        first_day = timezone.localdate() + timedelta(days=settings.SCHEDULE_WINDOW_DAYS + 10)
+        response = self.client.post(reverse('screening-schedules-list'),
+                                    dict(self.data, first_day=first_day, last_day=first_day + timedelta(days=5)))
+        # a run that read the schedule before another one materialized it
+        stale = ScreeningSchedule.objects.get(pk=response.data['id'])
+        until = first_day + timedelta(days=2)
+        self.assertEqual(schedules.materialize(until), 6)
+        self.assertEqual(schedules.materialize(until), 0)
+        self.assertEqual(schedules.materialize_schedule(stale, until), 0)
+        self.assertEqual(Screening.objects.filter(schedule=stale).count(), 6)
+
+    def test_movie_of_unmaterialized_schedule_cannot_change(self):
+        first_day = timezone.localdate() + timedelta(days=settings.SCHEDULE_WINDOW_DAYS + 10)
+        response = self.client.post(reverse('screening-schedules-list'),
+                                    dict(self.data, first_day=first_day, last_day=first_day + timedelta(days=5)))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Screening.objects.exists())
+        response = self.client.patch(reverse('movies-detail', kwargs={'pk': 1}), {'duration_minutes': 400})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], 'The movie cannot be updated while it is in screening schedules')
+
+    def test_intersecting_schedule_rejected(self):
+        self.client.post(reverse('screening-schedules-list'), self.data)
+        data = dict(self.data, movie=2, first_day=self.first_day + timedelta(days=40), times='11:00')
+        response = self.client.post(reverse('screening-schedules-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('times', response.data)
+        data['times'] = '14:00'
+        response = self.client.post(reverse('screening-schedules-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_screening_intersecting_pending_occurrence_rejected(self):
+        self.client.post(reverse('screening-schedules-list'), self.data)
+        start = timezone.make_aware(timezone.datetime.combine(self.first_day + timedelta(days=50),
+                                                              timezone.datetime(1, 1, 1, 10, 30).time()))
+        data = {'room': 1, 'movie': 2, 'start_time': start, 'price': 10}
+        response = self.client.post(reverse('screenings-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_times(self):
+        for times in ('7:30', '23:30', 'noon'):
+            response = self.client.post(reverse('screening-schedules-list'), dict(self.data, times=times))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DegradationTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.screening = Screening.objects.get(pk=1)
+        self.client.force_login(User.objects.get(username=USERNAME))
+        self.seats_url = reverse('available-seats', kwargs={'pk': self.screening.pk})
+
+    def _timeout(self, *args, **kwargs):
+        raise OperationalError('canceling statement due to statement timeout')
+
+    def test_stale_seat_map_served_on_timeout(self):
+        fresh = self.client.get(self.seats_url, {'format': 'rle'})
+        with mock.patch.object(SeatMap, 'for_screening', self._timeout):
+            response = self.client.get(self.seats_url, {'format': 'rle'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, fresh.content)
+        self.assertEqual(response[degradation.STALE_AGE_HEADER], '0')
+        self.assertFalse(fresh.has_header(degradation.STALE_AGE_HEADER))
+
+    def test_unavailable_without_last_good_copy(self):
+        with mock.patch.object(SeatMap, 'for_room', self._timeout):
+            response = self.client.get(self.seats_url)
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.client.get(reverse('best-seats', kwargs={'pk': self.screening.pk}), {'count': 2})
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        response = self.client.get(reverse('fallbacks'))
+        self.assertEqual(response.data, {'available-seats': 1, 'best-seats': 1, 'programme': 0})
+
+    def test_stale_programme_served_on_timeout(self):
+        url = reverse('programme', kwargs={'date': '2020-07-17'})
+        fresh = self.client.get(url)
+        programme.invalidate(self.screening.day)
+        with mock.patch.object(programme, 'rebuild', self._timeout):
+            response = self.client.get(url)
+        self.assertEqual(response.content, fresh.content)
+        self.assertIn(degradation.STALE_AGE_HEADER, response)
+
+
+class PermissionCacheTest(APITestCase):
+    fixtures = ['user.json']
+
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(name='programmers')
+        self.group.permissions.add(Permission.objects.get(codename='add_movie'))
+        User.objects.get(username=USERNAME).groups.add(self.group)
+
+    def _has_perm(self):
+        # a fresh user object, like on every request
+        return User.objects.get(username=USERNAME).has_perm('main.add_movie')
+
+    def test_permissions_are_cached_across_requests(self):
+        self.assertTrue(self._has_perm())
+        user = User.objects.get(username=USERNAME)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('main.add_movie'))
+
+    def test_group_permission_change_invalidates_cache(self):
+        self.assertTrue(self._has_perm())
+        self.group.permissions.clear()
+        self.assertFalse(self._has_perm())
+
+    def test_group_membership_change_invalidates_cache(self):
+        self.assertTrue(self._has_perm())
+        User.objects.get(username=USERNAME).groups.remove(self.group)
+        self.assertFalse(self._has_perm())
+
+    def test_permitted_user_creates_movie(self):
+        self.client.force_login(User.objects.get(username=USERNAME))
+        response = self.client.post(reverse('movies-list'), {'title': "The Lion King", "duration_minutes": 118})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class CinemaTest(APITestCase):
+    fixtures = ['movies.json', 'screenings.json']
+
+    def test_existing_rooms_belong_to_a_cinema(self):
+        cinema = Cinema.objects.get()
+        self.assertEqual(TheaterRoom.objects.filter(cinema=cinema).count(), 2)
+
+    def test_list_screenings_of_cinema(self):
+        cinema = Cinema.objects.get()
+        response = self.client.get(reverse('screenings-list'), {'cinema': cinema.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([s['cinema'] for s in response.data], [cinema.pk, cinema.pk])
+
+    def test_unknown_cinema(self):
+        response = self.client.get(reverse('screenings-list'), {'cinema': 100})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@skipUnless('shard2' in settings.DATABASES and 'shard2' in settings.CINEMA_SHARDS,
+            'needs a second database aliased shard2 in DATABASES and CINEMA_SHARDS')
+class ShardingTest(APITestCase):
+    databases = {'default', 'shard2'}
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'adminadmin')
+        self.movie = Movie.objects.create(title='Alien', duration_minutes=117)
+        self.cinema = Cinema.objects.create(name='Second Cinema', shard='shard2')
+        with sharding.shard('shard2'):
+            self.room = TheaterRoom.objects.create(cinema=self.cinema, name='Green Room', rows_count=2,
+                                                   seats_per_row_count=3)
+            Seat.objects.bulk_create(Seat(room=self.room, row=r, number=n) for r in (1, 2) for n in (1, 2, 3))
+        self.client.force_login(self.admin)
+
+    def _create_screening(self, day):
+        data = {'room': self.room.pk, 'movie': self.movie.pk, 'price': 100,
+                'start_time': timezone.datetime(2020, 7, day, 12, tzinfo=timezone.utc)}
+        return self.client.post(reverse('screenings-list') + '?cinema={}'.format(self.cinema.pk), data)
+
+    def test_reference_rows_are_replicated(self):
+        self.assertTrue(Movie.objects.using('shard2').filter(pk=self.movie.pk).exists())
+        self.assertTrue(User.objects.using('shard2').filter(pk=self.admin.pk).exists())
+
+    def test_cinema_data_is_stored_on_its_shard(self):
+        response = self._create_screening(17)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Screening.objects.using('shard2').filter(pk=response.data['id']).exists())
+        self.assertFalse(Screening.objects.using('default').filter(room__name='Green Room').exists())
+
+    def test_listing_without_cinema_merges_shards(self):
+        self._create_screening(18)
+        default_room = TheaterRoom.objects.using('default').first()
+        Screening.objects.using('default').create(room=default_room, movie=self.movie, price=100,
+                                                  start_time=timezone.datetime(2020, 7, 17, 12, tzinfo=timezone.utc))
+        response = self.client.get(reverse('screenings-list'))
+        self.assertEqual([s['cinema'] for s in response.data], [default_room.cinema_id, self.cinema.pk])
+
+    def test_merged_listing_links_to_the_cinema_of_each_screening(self):
+        self._create_screening(18)
+        default_room = TheaterRoom.objects.using('default').first()
+        Screening.objects.using('default').create(room=default_room, movie=self.movie, price=100,
+                                                  start_time=timezone.datetime(2020, 7, 17, 12, tzinfo=timezone.utc))
+        response = self.client.get(reverse('screenings-list'))
+        for screening in response.data:
+            self.assertTrue(screening['available_seats'].endswith('?cinema={}'.format(screening['cinema'])))
+        response = self.client.get(response.data[1]['available_seats'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 6)
+
+    def test_merged_listing_is_limited(self):
+        self._create_screening(17)
+        self._create_screening(18)
+        default_room = TheaterRoom.objects.using('default').first()
+        Screening.objects.using('default').create(room=default_room, movie=self.movie, price=100,
+                                                  start_time=timezone.datetime(2020, 7, 17, 18, tzinfo=timezone.utc))
+        response = self.client.get(reverse('screenings-list'), {'limit': 2})
+        self.assertEqual([s['start_time'][:13] for s in response.data], ['2020-07-17T12', '2020-07-17T18'])
+        response = self.client.get(reverse('screenings-list'), {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_movie_in_screenings_of_other_shard_cannot_be_deleted(self):
+        self._create_screening(17)
+        response = self.client.delete(reverse('movies-detail', kwargs={'pk': self.movie.pk}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OptimisticConcurrencyTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get(username=ADMIN_USERNAME))
+        self.screening_url = reverse('screenings-detail', kwargs={'pk': 1})
+        movie = Movie.objects.create(title='Up', duration_minutes=96)
+        self.movie_url = reverse('movies-detail', kwargs={'pk': movie.pk})
+
+    def test_retrieve_returns_etag(self):
+        response = self.client.get(self.screening_url)
+        self.assertEqual(response['ETag'], '"1"')
+
+    def test_update_with_current_etag(self):
+        etag = self.client.get(self.screening_url)['ETag']
+        response = self.client.patch(self.screening_url, {'price': 300}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(Screening.objects.get(pk=1).version, 2)
+
+    def test_concurrent_update_fails(self):
+        etag = self.client.get(self.screening_url)['ETag']
+        self.client.patch(self.screening_url, {'price': 300}, HTTP_IF_MATCH=etag)
+        response = self.client.patch(self.screening_url, {'price': 400}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Screening.objects.get(pk=1).price, 300)
+
+    def test_update_without_if_match_bumps_version(self):
+        response = self.client.patch(self.movie_url, {'duration_minutes': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"2"')
+
+    def test_movie_update_with_stale_etag_fails(self):
+        response = self.client.patch(self.movie_url, {'duration_minutes': 100}, HTTP_IF_MATCH='W/"5"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+
+class ChangeFeedTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.get(username=ADMIN_USERNAME)
+        self.user = User.objects.get(username=USERNAME)
+        self.url = reverse('changes')
+
+    def _feed(self, **params):
+        self.client.force_login(self.admin)
+        return self.client.get(self.url, params).data
+
+    def test_writes_are_logged_in_order(self):
+        self.client.force_login(self.user)
+        seat = Seat.objects.filter(room_id=1).first()
+        reservation_id = self.client.post(reverse('reservations-list'), {'screening': 1, 'seat': seat.pk}).data['id']
+        self.client.post(reverse('reservations-purchase', kwargs={'pk': reservation_id}))
+        self.client.force_login(self.admin)
+        self.client.delete(reverse('screenings-detail', kwargs={'pk': 2}))
+
+        feed = self._feed()
+        self.assertEqual([(e['entity'], e['action']) for e in feed['results']],
+                         [('reservation', 'created'), ('reservation', 'purchased'), ('screening', 'deleted')])
+        self.assertEqual(feed['results'][1]['payload']['price_paid'], 100)
+        self.assertEqual(feed['cursor'], feed['results'][-1]['position'])
+
+    def test_feed_continues_after_cursor(self):
+        self.client.force_login(self.admin)
+        self.client.post(reverse('movies-list'), {'title': 'Up', 'duration_minutes': 96})
+        self.client.post(reverse('movies-list'), {'title': 'Cars', 'duration_minutes': 117})
+        first = self._feed(limit=1)
+        self.assertEqual(first['results'][0]['payload']['title'], 'Up')
+        second = self._feed(after=first['cursor'])
+        self.assertEqual([e['payload']['title'] for e in second['results']], ['Cars'])
+        self.assertEqual(self._feed(after=second['cursor'])['results'], [])
+
+    def test_entry_committed_late_follows_the_cursor(self):
+        ChangeLogEntry.objects.create(id=1000, entity='movie', entity_id=1, action='updated', payload='{}')
+        cursor = self._feed()['cursor']
+        # a transaction that took its id before the entry above commits after the feed was read
+        ChangeLogEntry.objects.create(id=5, entity='movie', entity_id=2, action='updated', payload='{}')
+        feed = self._feed(after=cursor)
+        self.assertEqual([entry['id'] for entry in feed['results']], [5])
+        self.assertGreater(feed['cursor'], cursor)
+
+    def test_failed_write_is_not_logged(self):
+        self.client.force_login(self.admin)
+        Reservation.objects.create(screening_id=1, seat=Seat.objects.filter(room_id=1).first(), user=self.user,
+                                   reservation_time=timezone.now())
+        response = self.client.delete(reverse('screenings-detail', kwargs={'pk': 1}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._feed()['results'], [])
+
+    def test_feed_admin_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_feed_rejects_invalid_bounds(self):
+        self.client.force_login(self.admin)
+        for params in ({'limit': -5}, {'limit': 0}, {'after': -1}, {'limit': 'all'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProfilerTest(APITestCase):
+    fixtures = ['user.json', 'admin.json', 'movies.json', 'screenings.json']
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.get(username=ADMIN_USERNAME)
+        self.user = User.objects.get(username=USERNAME)
+        self.url = reverse('screenings-list')
+
+    def test_admin_profiles_request(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(self.url, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        report = self.client.get(reverse('profile', kwargs={'profile_id': response['X-Profile-Id']})).data
+        self.assertEqual(report['path'], self.url)
+        self.assertTrue(any('main_screening' in query['sql'] for query in report['queries']))
+        self.assertIn('cumulative', report['functions'])
+
+    def test_admin_profiles_request_with_jwt(self):
+        User.objects.create_user('staff', 'staff@example.com', 'staffstaff', is_staff=True)
+        token = self.client.post(reverse('token_obtain_pair'), {'username': 'staff', 'password': 'staffstaff'})
+        response = self.client.get(self.url, {'profile': 1}, HTTP_AUTHORIZATION='Bearer ' + token.data['access'])
+        self.assertIn('X-Profile-Id', response)
+
+    def test_user_request_is_not_profiled(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, {'profile': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+
+    def test_request_without_flag_is_not_profiled(self):
+        self.client.force_login(self.admin)
+        self.assertNotIn('X-Profile-Id', self.client.get(self.url))
@@ -8,8 +8,24 @@ router.register('accounts', views.UserView, basename='accounts')
 router.register('theater-rooms', views.TheaterRoomListView, basename='theater-room')
 router.register('movies', views.MovieViewSet, basename='movies')
 router.register('screenings', views.ScreeningViewSet, basename='screenings')
+router.register('screening-schedules', views.ScreeningScheduleViewSet, basename='screening-schedules')
+router.register('reservations', views.ReservationViewSet, basename='reservations')
+router.register('checkouts', views.CheckoutViewSet, basename='checkouts')
+router.register('stats/screenings', views.ScreeningStatsViewSet, basename='screening-stats')
+router.register('stats/movies', views.MovieStatsViewSet, basename='movie-stats')
+router.register('stats/days', views.DailyStatsViewSet, basename='daily-stats')
 
 urlpatterns = router.urls
 
 urlpatterns += path('screenings/<int:pk>/available-seats', views.AvailableScreeningSeatsView.as_view(),
                     name='available-seats'),
+urlpatterns += path('screenings/<int:pk>/best-seats', views.BestAvailableSeatsView.as_view(), name='best-seats'),
+urlpatterns += path('screenings/<int:pk>/waiting-room', views.WaitingRoomJoinView.as_view(),
+                    name='waiting-room-join'),
+urlpatterns += path('waiting-room/<str:token>', views.WaitingRoomTicketView.as_view(), name='waiting-room-ticket'),
+urlpatterns += path('export/<str:name>', views.ExportView.as_view(), name='export'),
+urlpatterns += path('programme', views.ProgrammeView.as_view(), name='programme-today'),
+urlpatterns += path('programme/<str:date>', views.ProgrammeView.as_view(), name='programme'),
+urlpatterns += path('fallbacks', views.FallbackCountsView.as_view(), name='fallbacks'),
+urlpatterns += path('changes', views.ChangeFeedView.as_view(), name='changes'),
+urlpatterns += path('profiles/<str:profile_id>', views.ProfileView.as_view(), name='profile'),
@@ -1,12 +1,35 @@
+import copy
+from datetime import datetime, timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, IntegrityError, OperationalError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Round
+from django.http import StreamingHttpResponse, HttpResponse
+from django.utils import timezone
 from rest_framework import viewsets, permissions, status, generics
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-from main import permissions as custom_permissions
-from main.models import TheaterRoom, Movie, Screening, Reservation, Seat
-from main.serializers import UserSerializer, TheaterRoomSerializer, MovieSerializer, ScreeningSerializer
+from main import permissions as custom_permissions, waiting_room, stats, export, programme, sharding, outbox, \
+    profiling, schedules, checkout, compression, degradation
+from main.compression import precompressed
+from main.concurrency import OptimisticConcurrencyMixin
+from main.fieldsets import SparseFieldsViewMixin
+from main.idempotency import idempotent
+from main.pagination import UserCursorPagination
+from main.models import TheaterRoom, Movie, Screening, Reservation, Seat, ScreeningStats, MovieStats, DailyStats, \
+    ChangeLogEntry, ScreeningSchedule, Checkout
+from main.renderers import SeatMapRLERenderer, SeatMapBitmapRenderer, CSVRenderer, JSONLinesRenderer
+from main.seat_map import SeatMap, category_mask
+from main.serializers import UserSerializer, TheaterRoomSerializer, MovieSerializer, ScreeningSerializer, \
+    ReservationSerializer, ScreeningStatsSerializer, MovieStatsSerializer, DailyStatsSerializer, \
+    ChangeLogEntrySerializer, ScreeningScheduleSerializer, BulkPriceSerializer, UserFilterSerializer, \
+    SeatCategoriesSerializer, CheckoutSerializer
 
 
 class UserView(viewsets.ModelViewSet):
@@ -15,18 +38,67 @@ class UserView(viewsets.ModelViewSet):
                           custom_permissions.ListAdminOnly)
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        # a plain dict, form semantics would read a missing is_staff as false
+        filters = UserFilterSerializer(data=self.request.query_params.dict())
+        filters.is_valid(raise_exception=True)
+        return filters.filter(queryset)
 
 
-class TheaterRoomListView(viewsets.GenericViewSet, viewsets.mixins.ListModelMixin):
+class MergedListMixin:
+    """ Lists of all shards for requests without a cinema, in the given order and limited to ``?limit=<n>`` rows.
+    Ids are only unique within a cinema, the rows carry their cinema to address them with ``?cinema=<id>`` """
+    MERGED_MAX_LIMIT = 1000
+
+    def merged_list(self, request, *ordering):
+        try:
+            limit = min(int(request.query_params.get('limit', self.MERGED_MAX_LIMIT)), self.MERGED_MAX_LIMIT)
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'detail': 'limit should be an integer.'})
+        if limit < 1:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'detail': 'limit should be positive.'})
+        rows = sharding.merged(self.filter_queryset(self.get_queryset()), *ordering, limit=limit)
+        return Response(self.get_serializer(rows, many=True).data)
+
+
+class TheaterRoomListView(SparseFieldsViewMixin, MergedListMixin, viewsets.GenericViewSet,
+                          viewsets.mixins.ListModelMixin):
     queryset = TheaterRoom.objects.all()
     serializer_class = TheaterRoomSerializer
+    loaded_fields = ('cinema',)
+
+    @precompressed(TheaterRoom)
+    def list(self, request, *args, **kwargs):
+        if sharding.get_active_shard() is not None or len(settings.CINEMA_SHARDS) == 1:
+            return super().list(request, *args, **kwargs)
+        return self.merged_list(request, 'cinema_id', 'pk')
 
+    @action(detail=True, methods=['get', 'put'], url_path='seat-categories', serializer_class=SeatCategoriesSerializer,
+            permission_classes=(permissions.DjangoModelPermissionsOrAnonReadOnly,))
+    def seat_categories(self, request, pk=None):
+        room = self.get_object()
+        if request.method == 'GET':
+            return Response(self.get_serializer(room).data)
+        serializer = self.get_serializer(room, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
 
-class MovieViewSet(viewsets.ModelViewSet):
+
+class MovieViewSet(SparseFieldsViewMixin, OptimisticConcurrencyMixin, viewsets.ModelViewSet):
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
     queryset = Movie.objects.all()
     serializer_class = MovieSerializer
 
+    @precompressed(Movie)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def destroy(self, request, *args, **kwargs):
         try:
             return super().destroy(request, *args, **kwargs)
@@ -41,22 +113,115 @@ class MovieViewSet(viewsets.ModelViewSet):
         return call_method_catch_exception(models.deletion.ProtectedError, super().partial_update, request, *args,
                                            **kwargs)
 
+    @transaction.atomic
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        outbox.record(serializer.instance, ChangeLogEntry.CREATED)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        outbox.record(serializer.instance, ChangeLogEntry.UPDATED)
 
-class ScreeningViewSet(viewsets.ModelViewSet):
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        outbox.record(instance, ChangeLogEntry.DELETED)
+        super().perform_destroy(instance)
+
+
+class ScreeningViewSet(SparseFieldsViewMixin, MergedListMixin, OptimisticConcurrencyMixin,
+                       viewsets.ModelViewSet):
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
 
-    queryset = Screening.objects.all()
+    queryset = Screening.objects.select_related('room')
     serializer_class = ScreeningSerializer
+    loaded_fields = ('start_time',)
+
+    @precompressed(Screening, TheaterRoom)
+    def list(self, request, *args, **kwargs):
+        if sharding.get_active_shard() is not None or len(settings.CINEMA_SHARDS) == 1:
+            return super().list(request, *args, **kwargs)
+        return self.merged_list(request, 'start_time', 'pk')
 
     def create(self, request, *args, **kwargs):
         return call_method_catch_exception(ValidationError, super().create, request, *args, **kwargs)
 
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except models.deletion.ProtectedError:
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': 'The screening cannot be deleted while it has reservations'})
+
+    @sharding.atomic
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        stats.screening_created(serializer.instance)
+        programme.schedule_changed(serializer.instance.day)
+        outbox.record(serializer.instance, ChangeLogEntry.CREATED)
+
+    @sharding.atomic
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        super().perform_update(serializer)
+        stats.screening_updated(previous, serializer.instance)
+        programme.schedule_changed(previous.day, serializer.instance.day)
+        outbox.record(serializer.instance, ChangeLogEntry.UPDATED)
+
+    @sharding.atomic
+    def perform_destroy(self, instance):
+        outbox.record(instance, ChangeLogEntry.DELETED)
+        super().perform_destroy(instance)
+        stats.screening_deleted(instance)
+        programme.schedule_changed(instance.day)
+
     def update(self, request, *args, **kwargs):
         return call_method_catch_exception(ValidationError, super().update, request, *args, **kwargs)
 
     def partial_update(self, request, *args, **kwargs):
         return call_method_catch_exception(ValidationError, super().partial_update, request, *args, **kwargs)
 
+    @action(detail=False, methods=['post'], url_path='bulk-price', serializer_class=BulkPriceSerializer,
+            permission_classes=(custom_permissions.ChangeModelPermissions,))
+    def bulk_price(self, request):
+        """ Sets or changes by a percentage the price of all selected screenings with a single UPDATE, and of the
+        schedules whose occurrences that are not screenings yet are all selected.
+        Start times are untouched, so the screenings are not validated again """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if 'price' in serializer.validated_data:
+            price = Value(serializer.validated_data['price'])
+        else:
+            factor = (100 + serializer.validated_data['percent']) / 100
+            price = Greatest(Round(F('price') * Value(factor)), Value(1), output_field=models.IntegerField())
+        with sharding.atomic():
+            # locked against materialize_schedules, which creates screenings at the price of the schedule
+            schedule_pks = serializer.pending_schedules(schedules.unmaterialized().select_for_update())
+            ScreeningSchedule.objects.filter(pk__in=schedule_pks).update(price=price)
+            screenings = serializer.filter(Screening.objects.all())
+            updated_count = screenings.update(price=price, version=F('version') + 1)
+            compression.invalidate(Screening)
+            updated = list(screenings.select_related('room'))
+            programme.schedule_changed(*(screening.day for screening in updated))
+            outbox.record_many(updated, ChangeLogEntry.UPDATED)
+        return Response(data={'updated': updated_count, 'days': len({screening.day for screening in updated}),
+                              'schedules': len(schedule_pks)})
+
+
+class ScreeningScheduleViewSet(viewsets.GenericViewSet, viewsets.mixins.CreateModelMixin,
+                                viewsets.mixins.ListModelMixin, viewsets.mixins.RetrieveModelMixin,
+                                viewsets.mixins.DestroyModelMixin):
+    """ Recurring screenings. Deleting a schedule keeps its screenings created so far """
+    permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
+    queryset = ScreeningSchedule.objects.all()
+    serializer_class = ScreeningScheduleSerializer
+
+    @sharding.atomic
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        schedules.materialize_schedule(serializer.instance,
+                                       timezone.localdate() + timedelta(days=settings.SCHEDULE_WINDOW_DAYS))
+
 
 def call_method_catch_exception(exception, method, request, *args, **kwargs):
     try:
@@ -67,10 +232,281 @@ def call_method_catch_exception(exception, method, request, *args, **kwargs):
 
 
 class AvailableScreeningSeatsView(generics.GenericAPIView):
-    permission_classes = (permissions.IsAuthenticated,)
+    permission_classes = (permissions.IsAuthenticated, custom_permissions.AdmittedFromWaitingRoom)
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (SeatMapRLERenderer, SeatMapBitmapRenderer)
+
+    def get_waiting_room_screening(self):
+        return self.kwargs['pk']
+
+    def get(self, request, pk):
+        try:
+            category = category_mask(request.query_params.get('category', ''))
+        except ValueError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'category': str(e)})
+        as_seat_map = isinstance(request.accepted_renderer, (SeatMapRLERenderer, SeatMapBitmapRenderer))
+        key = 'available-seats:{}:{}:{}'.format(pk, category, 'map' if as_seat_map else 'seats')
+        try:
+            with degradation.time_budget('available-seats'):
+                screening = get_object_or_404(Screening.objects.select_related('room'), pk=pk)
+                if as_seat_map:
+                    seat_map = SeatMap.for_screening(screening, category)
+                    degradation.remember(key, seat_map.to_rle())
+                    return Response(seat_map)
+                available_seats = self.get_available_seats(screening, category)
+        except OperationalError:
+            respond = (lambda rle: Response(SeatMap.from_rle(rle))) if as_seat_map else Response
+            return serve_last_good('available-seats', key, respond)
+        degradation.remember(key, available_seats)
+        return Response(available_seats)
+
+    @staticmethod
+    def get_available_seats(screening, category):
+        reserved_seats = Reservation.objects.filter(screening=screening).values_list('seat_id', flat=True)
+        unoccupied_seats = Seat.objects.filter(room=screening.room).exclude(id__in=reserved_seats)
+        # categories are stored on the room, the seats of other categories are dropped while reading
+        seat_map = SeatMap.for_room(screening.room, category)
+        return [seat_pk for seat_pk, row, number in unoccupied_seats.values_list('pk', 'row', 'number')
+                if seat_map.is_available(row, number)]
+
+
+class BestAvailableSeatsView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticated, custom_permissions.AdmittedFromWaitingRoom)
+
+    def get_waiting_room_screening(self):
+        return self.kwargs['pk']
 
     def get(self, request, pk):
-        screening = Screening.objects.get(pk=pk)
-        reservations = Reservation.objects.filter(screening=screening)
-        unoccupied_seats = Seat.objects.filter(room=screening.room).exclude(id__in=(r.seat.pk for r in reservations))
-        return Response(s.pk for s in unoccupied_seats)
+        try:
+            count = int(request.query_params.get('count', 1))
+        except ValueError:
+            count = 0
+        try:
+            category = category_mask(request.query_params.get('category', ''))
+        except ValueError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'category': str(e)})
+        key = 'best-seats:{}:{}:{}'.format(pk, count, category)
+        try:
+            with degradation.time_budget('best-seats'):
+                response = self.get_best_seats(pk, count, category)
+        except OperationalError:
+            return serve_last_good('best-seats', key)
+        if response.status_code == status.HTTP_200_OK:
+            degradation.remember(key, response.data)
+        return response
+
+    @staticmethod
+    def get_best_seats(pk, count, category):
+        screening = get_object_or_404(Screening.objects.select_related('room'), pk=pk)
+        if not 1 <= count <= screening.room.seats_per_row_count:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={
+                'count': 'Ensure this value is between 1 and {}.'.format(screening.room.seats_per_row_count)})
+        block = SeatMap.for_screening(screening, category).best_block(count)
+        if block is None:
+            return Response(status=status.HTTP_404_NOT_FOUND,
+                            data={'detail': 'There are no {} adjacent seats available.'.format(count)})
+        row, first = block
+        seats = Seat.objects.filter(room=screening.room, row=row, number__range=(first, first + count - 1))
+        return Response({'row': row, 'numbers': list(range(first, first + count)),
+                         'seats': list(seats.order_by('number').values_list('pk', flat=True))})
+
+
+def serve_last_good(name, key, respond=Response):
+    """ Response of the last good copy of the data under key marked as stale, or 503 without one """
+    degradation.count_fallback(name)
+    last_good = degradation.recall(key)
+    if last_good is None:
+        return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'},
+                        data={'detail': 'The service is busy, please retry.'})
+    value, age = last_good
+    return degradation.mark_stale(respond(value), age)
+
+
+class ReservationViewSet(viewsets.GenericViewSet, viewsets.mixins.CreateModelMixin,
+                         viewsets.mixins.ListModelMixin, viewsets.mixins.RetrieveModelMixin):
+    permission_classes = (permissions.IsAuthenticated, custom_permissions.AdmittedFromWaitingRoom)
+    serializer_class = ReservationSerializer
+
+    def get_waiting_room_screening(self):
+        if self.action != 'create':
+            return None
+        try:
+            return int(self.request.data.get('screening'))
+        except (TypeError, ValueError):
+            return None
+
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return Reservation.objects.all()
+        return Reservation.objects.filter(user=self.request.user)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        try:
+            with sharding.atomic():
+                return super().create(request, *args, **kwargs)
+        except IntegrityError:
+            # another request took the seat between validation and insert
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': 'The seat is already reserved for this screening.'})
+
+    @action(detail=True, methods=['post'])
+    @idempotent
+    def purchase(self, request, pk=None):
+        reservation = self.get_object()
+        with sharding.atomic():
+            reservation = Reservation.objects.select_for_update().select_related('screening').get(pk=reservation.pk)
+            if reservation.is_purchased:
+                return Response(status=status.HTTP_400_BAD_REQUEST,
+                                data={'detail': 'The reservation is already purchased.'})
+            reservation.purchase_time = timezone.now()
+            reservation.price_paid = reservation.screening.price
+            reservation.save(update_fields=['purchase_time', 'price_paid'])
+            stats.reservation_purchased(reservation)
+            outbox.record(reservation, ChangeLogEntry.PURCHASED)
+        return Response(self.get_serializer(reservation).data)
+
+    @action(detail=True, methods=['post'])
+    @idempotent
+    def checkout(self, request, pk=None):
+        """ Queues the purchase for the checkout workers, its progress is polled at the returned url """
+        try:
+            order = checkout.start(self.get_object())
+        except checkout.CheckoutError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'detail': str(e)})
+        data = CheckoutSerializer(order, context=self.get_serializer_context()).data
+        return Response(status=status.HTTP_202_ACCEPTED, data=data, headers={'Location': data['url']})
+
+
+class CheckoutViewSet(viewsets.ReadOnlyModelViewSet):
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = CheckoutSerializer
+
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return Checkout.objects.all()
+        return Checkout.objects.filter(reservation__user=self.request.user)
+
+    @action(detail=False, permission_classes=(permissions.IsAdminUser,))
+    def metrics(self, request):
+        return Response(checkout.metrics())
+
+
+class WaitingRoomJoinView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, pk):
+        screening = get_object_or_404(Screening, pk=pk)
+        token, ticket_status = waiting_room.join(screening.pk, request.user)
+        return Response(status=status.HTTP_201_CREATED, data=dict(ticket_status, token=token))
+
+
+class WaitingRoomTicketView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, token):
+        return call_waiting_room(waiting_room.get_status, token)
+
+    def delete(self, request, token):
+        return call_waiting_room(waiting_room.leave, token, status_code=status.HTTP_204_NO_CONTENT)
+
+
+def call_waiting_room(function, token, status_code=status.HTTP_200_OK):
+    try:
+        return Response(status=status_code, data=function(token))
+    except waiting_room.InvalidToken:
+        return Response(status=status.HTTP_404_NOT_FOUND, data={'detail': 'Unknown waiting room token.'})
+
+
+class ScreeningStatsViewSet(viewsets.ReadOnlyModelViewSet):
+    permission_classes = (permissions.IsAdminUser,)
+    queryset = ScreeningStats.objects.all()
+    serializer_class = ScreeningStatsSerializer
+
+
+class MovieStatsViewSet(viewsets.ReadOnlyModelViewSet):
+    permission_classes = (permissions.IsAdminUser,)
+    queryset = MovieStats.objects.all()
+    serializer_class = MovieStatsSerializer
+
+
+class DailyStatsViewSet(viewsets.ReadOnlyModelViewSet):
+    permission_classes = (permissions.IsAdminUser,)
+    queryset = DailyStats.objects.all()
+    serializer_class = DailyStatsSerializer
+    lookup_field = 'date'
+    lookup_value_regex = r'\d{4}-\d{2}-\d{2}'
+
+
+class ExportView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAdminUser,)
+    renderer_classes = (CSVRenderer, JSONLinesRenderer)
+
+    def get(self, request, name):
+        if name not in export.EXPORTS:
+            return Response(status=status.HTTP_404_NOT_FOUND, data={'detail': 'Unknown export.'})
+        try:
+            columns, rows = export.export_rows(name, month=request.query_params.get('month'))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'month': 'Expected a month as YYYY-MM.'})
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(export.FORMATS[renderer.format](columns, rows),
+                                         content_type='{}; charset=utf-8'.format(renderer.media_type))
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(name, renderer.format)
+        return response
+
+
+class ProgrammeView(generics.GenericAPIView):
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, date=None):
+        if date is None:
+            day = timezone.localdate()
+        else:
+            try:
+                day = datetime.strptime(date, '%Y-%m-%d').date()
+            except ValueError:
+                return Response(status=status.HTTP_400_BAD_REQUEST, data={'date': 'Expected a date as YYYY-MM-DD.'})
+        try:
+            with degradation.time_budget('programme'):
+                document = programme.get_document(day)
+        except OperationalError:
+            return serve_last_good('programme', programme.last_good_key(day),
+                                   lambda document: HttpResponse(document, content_type='application/json'))
+        return HttpResponse(document, content_type='application/json')
+
+
+class FallbackCountsView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(degradation.fallback_counts())
+
+
+class ChangeFeedView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAdminUser,)
+    serializer_class = ChangeLogEntrySerializer
+    MAX_LIMIT = 1000
+
+    def get(self, request):
+        try:
+            after = int(request.query_params.get('after', 0))
+            limit = min(int(request.query_params.get('limit', self.MAX_LIMIT)), self.MAX_LIMIT)
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': 'after and limit should be integers.'})
+        if after < 0 or limit < 1:
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': 'after should not be negative and limit should be positive.'})
+        entries = list(outbox.read(after, limit))
+        return Response({'results': self.get_serializer(entries, many=True).data,
+                         'cursor': entries[-1].position if entries else after})
+
+
+class ProfileView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request, profile_id):
+        report = profiling.get_report(profile_id)
+        if report is None:
+            return Response(status=status.HTTP_404_NOT_FOUND, data={'detail': 'Unknown or expired profile.'})
+        return Response(report)
@@ -0,0 +1,132 @@
+""" Admission control for the reservation traffic of a screening.
+
+Visitors join the waiting room of a screening and get a signed token holding their number in the queue.
+Numbers are admitted in order, at most ADMIT_RATE per second and only while fewer than MAX_ACTIVE_SESSIONS
+admitted sessions are active. A session ends when the visitor leaves or after SESSION_TTL seconds.
+The state of each screening is kept in the Django cache, which must be shared by all workers for them to serve
+one queue; the system checks fail when the waiting room is enabled on a process-local cache. """
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+from main import sharding
+
+TOKEN_SALT = 'main.waiting_room'
+STATE_TIMEOUT = 24 * 60 * 60
+LOCK_TIMEOUT = 5
+LOCK_WAIT_SECONDS = 1
+
+WAITING = 'waiting'
+ADMITTED = 'admitted'
+EXPIRED = 'expired'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def join(screening_pk, user):
+    key = _key(screening_pk, 'issued')
+    cache.add(key, 0, timeout=STATE_TIMEOUT)
+    number = cache.incr(key)
+    token = signing.dumps({'shard': sharding.current_db(), 'screening': screening_pk, 'user': user.pk,
+                           'number': number}, salt=TOKEN_SALT)
+    return token, get_status(token)
+
+
+def get_status(token):
+    ticket = _load(token)
+    with sharding.shard(ticket['shard']):
+        state = _advance(ticket['screening'])
+    return _status(state, ticket['number'])
+
+
+def leave(token):
+    ticket = _load(token)
+    with sharding.shard(ticket['shard']), _locked(ticket['screening'], wait=True):
+        state = _get_state(ticket['screening'])
+        if ticket['number'] > state['admitted']:
+            state['abandoned'].add(ticket['number'])
+        state['active'].pop(ticket['number'], None)
+        cache.set(_key(ticket['screening'], 'state'), state, timeout=STATE_TIMEOUT)
+
+
+def is_admitted(token, screening_pk, user):
+    try:
+        ticket = _load(token)
+    except InvalidToken:
+        return False
+    if (ticket['shard'], ticket['screening'], ticket['user']) != (sharding.current_db(), screening_pk, user.pk):
+        return False
+    return _status(_get_state(screening_pk), ticket['number'])['status'] == ADMITTED
+
+
+def _advance(screening_pk):
+    """ Admits the next numbers in the queue, limited by the token bucket and the free session slots """
+    with _locked(screening_pk) as acquired:
+        state = _get_state(screening_pk)
+        if not acquired:
+            return state
+        config = settings.WAITING_ROOM
+        now = time.time()
+        state['active'] = {n: expires for n, expires in state['active'].items() if expires > now}
+        allowance = min(state['allowance'] + (now - state['updated']) * config['ADMIT_RATE'],
+                        config['MAX_ACTIVE_SESSIONS'])
+        issued = cache.get(_key(screening_pk, 'issued'), 0)
+        while state['admitted'] < issued and allowance >= 1 \
+                and len(state['active']) < config['MAX_ACTIVE_SESSIONS']:
+            state['admitted'] += 1
+            if state['admitted'] in state['abandoned']:
+                state['abandoned'].discard(state['admitted'])
+                continue
+            state['active'][state['admitted']] = now + config['SESSION_TTL']
+            allowance -= 1
+        state['allowance'] = allowance
+        state['updated'] = now
+        cache.set(_key(screening_pk, 'state'), state, timeout=STATE_TIMEOUT)
+        return state
+
+
+def _status(state, number):
+    if number > state['admitted']:
+        return {'status': WAITING, 'position': number - state['admitted']}
+    if state['active'].get(number, 0) > time.time():
+        return {'status': ADMITTED, 'position': 0}
+    return {'status': EXPIRED, 'position': 0}
+
+
+def _get_state(screening_pk):
+    state = cache.get(_key(screening_pk, 'state'))
+    if state is None:
+        state = {'admitted': 0, 'allowance': settings.WAITING_ROOM['MAX_ACTIVE_SESSIONS'], 'updated': time.time(),
+                 'active': {}, 'abandoned': set()}
+    return state
+
+
+@contextmanager
+def _locked(screening_pk, wait=False):
+    lock_key = _key(screening_pk, 'lock')
+    deadline = time.time() + LOCK_WAIT_SECONDS
+    acquired = cache.add(lock_key, True, timeout=LOCK_TIMEOUT)
+    while not acquired and wait and time.time() < deadline:
+        time.sleep(0.01)
+        acquired = cache.add(lock_key, True, timeout=LOCK_TIMEOUT)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(lock_key)
+
+
+def _load(token):
+    try:
+        return signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        raise InvalidToken()
+
+
+def _key(screening_pk, name):
+    return 'waiting-room:{}:{}:{}'.format(sharding.current_db(), screening_pk, name)